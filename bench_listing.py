@@ -0,0 +1,69 @@
+import io
+import json
+import sys
+import time
+import tracemalloc
+
+import crawl_utils
+from crawl_utils import parse_listing
+
+
+def make_listing(count):
+    """Builds the body of a synthetic folder listing with count children"""
+    children = ({
+        "name": f"artifact-{i:07d}.zip",
+        "folder": i % 50 == 0,
+        "size": str(1024 + i),
+        "lastModified": f"2023-{1 + i % 12:02d}-{1 + i % 28:02d}T10:{i % 60:02d}:00.000Z"
+    } for i in range(count))
+    listing = {"repo": "bench", "path": "/bench/folder", "folder": True, "children": list(children)}
+    return json.dumps(listing).encode()
+
+
+def load_whole(body):
+    """The previous behaviour: decode the text, load the whole document and sort the children"""
+    json_text = json.loads(io.BytesIO(body).read().decode())
+    first = None
+    for child in sorted(json_text.get("children"), key=lambda x: x.get('lastModified'), reverse=True):
+        if first is None:
+            first = time.perf_counter()
+    return first
+
+
+def load_streamed(body):
+    """Children are parsed from the stream and handed over one at a time, whatever the size of the listing"""
+    json_text, children = parse_listing(io.BytesIO(body))
+    first = None
+    for child in children:
+        if first is None:
+            first = time.perf_counter()
+    return first
+
+
+def measure(name, func, body):
+    start = time.perf_counter()
+    first = func(body)
+    end = time.perf_counter()
+
+    # measured in a second run, tracemalloc slows down the allocations a lot
+    tracemalloc.start()
+    func(body)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f'{name:>10}: total {end - start:8.3f}s, first child after {first - start:8.3f}s, '
+          f'peak memory {peak / 2 ** 20:8.1f} MiB')
+
+
+if __name__ == '__main__':
+    counts = [int(arg) for arg in sys.argv[1:]] or [10000, 100000, 500000]
+
+    backend = 'ijson ' + crawl_utils.ijson.backend if crawl_utils.ijson is not None else \
+        'orjson' if crawl_utils.orjson is not None else 'json'
+    print(f'listing parser: {backend}')
+
+    for count in counts:
+        body = make_listing(count)
+        print(f'{count} children, {len(body) / 2 ** 20:.1f} MiB listing')
+        measure('whole', load_whole, body)
+        measure('streamed', load_streamed, body)
@@ -0,0 +1,47 @@
+import sys
+import tracemalloc
+
+from meta_store import MetaStore
+
+
+# how the synthetic files write their sizes and dates: the Artifactory listings, the autoindex pages
+# of the html crawler, and iso dates with an offset
+STYLES = {
+    "artifactory": lambda i: (str(1024 + i), f"2023-{1 + i % 12:02d}-{1 + i % 28:02d}T10:{i % 60:02d}:00.000Z"),
+    "autoindex": lambda i: (f"{1 + i % 100 / 10:.1f}K", f"{1 + i % 28:02d}-{MONTHS[i % 12]}-2023 10:{i % 60:02d}"),
+    "offset": lambda i: (str(1024 + i), f"2023-{1 + i % 12:02d}-{1 + i % 28:02d}T10:{i % 60:02d}:00.000+02:00")
+}
+MONTHS = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+
+
+def make_records(count, style):
+    """Yields the path and the metadata of count synthetic files, as they are read from meta.json"""
+    for i in range(count):
+        name = f"artifact-{i:07d}.zip"
+        size, last_modified = STYLES[style](i)
+        yield f"/repo/group-{i // 1000:04d}/module-{i // 100 % 10}/{name}", {
+            "name": name,
+            "size": size,
+            "lastModified": last_modified
+        }
+
+
+def measure(name, build, count, style):
+    tracemalloc.start()
+    meta_data = build(make_records(count, style))
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f'{name:>10}: {size / count:8.1f} bytes per tracked file, {size / 2 ** 20:8.1f} MiB for {len(meta_data)} files')
+    return size
+
+
+if __name__ == '__main__':
+    counts = [int(arg) for arg in sys.argv[1:]] or [100000, 1000000]
+
+    for count in counts:
+        for style in STYLES:
+            print(f'{style} sizes and dates:')
+            before = measure('dict', dict, count, style)
+            after = measure('MetaStore', MetaStore, count, style)
+            print(f'{before / after:.1f}x less memory')
@@ -0,0 +1,1287 @@
+import logging
+import os
+import heapq
+import io
+import itertools
+import json
+import random
+import re
+import signal
+import subprocess
+import sys
+import threading
+import time
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime
+from pathlib import Path
+from urllib.parse import urlparse, urljoin, unquote
+
+import requests
+from bs4 import BeautifulSoup
+
+from crawl_utils import add_unique_postfix, get_domain, get_domains, parse_listing, parse_size, parse_timestamp, \
+    NewestFiles, FolderRules, session_file, load_cookies, save_cookies, write_status, RELOGIN_STATUS_CODES
+from crawl_state import CrawlState
+from host_scheduler import HostScheduler, AdaptiveScheduler, OVERLOAD_STATUS_CODES
+from progress import Progress, ProgressReporter, format_progress
+from post_process import PostProcessing, Stream, iter_zip
+from replay import Recorder, start_replay
+from meta_store import MetaStore, is_same_file
+
+# a file or a folder found while crawling, path is its path on the server and repo is only known for json listings
+Entry = namedtuple('Entry', ['url', 'path', 'name', 'folder', 'size', 'last_modified', 'repo'],
+                   defaults=(None, None, True, None, None, None))
+
+# config keys of the entry points, by the name of the constructor parameter they are given to
+CONFIG_KEYS = {
+    "urls": "urls",
+    "accepted_domains": "accepted_domains",
+    "download_folder": "download_folder",
+    "verify": "verify",
+    "username": "username",
+    "password": "password",
+    "login": "login",
+    "login_url": "login_url",
+    "download_url_path": "download_url",
+    "regex": "regex",
+    "webhook_url": "webhook-url",
+    "webhook_download_link": "webhook-download-link",
+    "files_remaining": "files-count",
+    "prune_folders": "files-count-prune",
+    "session_path": "session-file",
+    "state_path": "state-db",
+    "max_workers": "max-workers",
+    "max_per_host": "max-per-host",
+    "host_delay": "host-delay",
+    "status_path": "status-file",
+    "progress_interval": "progress-interval",
+    "post_process": "post-process",
+    "post_workers": "post-workers",
+    "include_folders": "include-folders",
+    "exclude_folders": "exclude-folders",
+    "record_path": "record",
+    "record_downloads": "record-downloads",
+    "traversal": "traversal",
+    "adaptive_concurrency": "adaptive-concurrency",
+    "download_folder_url_path": "download_folder_url",
+    "archive_min_files": "archive-min-files",
+    "archive_max_size": "archive-max-size",
+    "archive_ratio": "archive-ratio"
+}
+
+# times a request answered 429 or 503 is sent again when the concurrency is adaptive
+THROTTLE_RETRIES = 3
+
+# orders in which the frontier of each host is visited
+TRAVERSALS = ('bfs', 'dfs', 'best-first')
+
+
+def remove_control(line):
+    return ''.join(c for c in line if ord(c) >= 32)
+
+
+def is_absolute(url):
+    return bool(urlparse(url).netloc)
+
+
+def get_linked_urls(url, html):
+    """Parse an html page and yield the urls of other pages with the date and the size written after the link
+    """
+    soup = BeautifulSoup(html, 'html.parser')
+    for link in soup.find_all('a'):
+        path = link.get('href')
+
+        # skip the parent folder and the links that only sort the page
+        if path is None or path == "../" or path.startswith(('?', '#')):
+            continue
+
+        if not is_absolute(path):
+            path = urljoin(url, path)
+
+        last_modified, _, size = remove_control(str(link.nextSibling or '')).strip().rpartition(' ')
+        yield path, size, last_modified.strip() or None
+
+
+def remove_patch_id(path):
+    dir_path, file = os.path.split(path)
+    dir_path = dir_path.rsplit('-', 1)[0]
+    return os.path.join(dir_path, file).replace("\\", "/")
+
+
+def newest_first(entry):
+    """Sort key of the best-first traversal, the most recently modified entries come first and the undated ones last"""
+    return -parse_timestamp(entry.last_modified)
+
+
+def get_retry_after(res):
+    """Seconds of the Retry-After header of the response, None if it has none or it is a date"""
+    retry_after = res.headers.get('Retry-After', '')
+    return int(retry_after) if retry_after.isdigit() else None
+
+
+def keep_chunks(chunks, kept):
+    """Yields the chunks, appending them to the list kept if it isn't None"""
+    for chunk in chunks:
+        if kept is not None:
+            kept.append(chunk)
+        yield chunk
+
+
+def get_host(url):
+    return urlparse(url).netloc
+
+
+class Frontier:
+    """Queue of the entries left to visit for each host, with constant time lookups of their urls.
+
+    The traversal decides the order of each queue: breadth first ("bfs"), depth first ("dfs"),
+    which keeps the frontier to about the depth of the tree times the size of a folder and reaches the first files sooner,
+    or the most recently modified entries first ("best-first").
+    """
+
+    def __init__(self, entries=(), traversal='bfs'):
+        if traversal not in TRAVERSALS:
+            raise ValueError(f'Unknown traversal: {traversal}, expected one of {TRAVERSALS}')
+        self.traversal = traversal
+        self.queues = dict()
+        self.urls = set()
+        # ties of the best-first traversal are visited in the order they were found
+        self.order = itertools.count()
+
+        for entry in entries:
+            self.push(entry)
+
+    def __len__(self):
+        return len(self.urls)
+
+    def __contains__(self, url):
+        return url in self.urls
+
+    def hosts(self):
+        """The hosts that have entries waiting"""
+        return list(self.queues)
+
+    def push(self, entry):
+        if self.traversal == 'best-first':
+            heapq.heappush(self.queues.setdefault(get_host(entry.url), []),
+                           (newest_first(entry), next(self.order), entry))
+        else:
+            self.queues.setdefault(get_host(entry.url), deque()).append(entry)
+        self.urls.add(entry.url)
+
+    def take(self, queue):
+        if self.traversal == 'bfs':
+            return queue.popleft()
+        if self.traversal == 'dfs':
+            return queue.pop()
+        return heapq.heappop(queue)[2]
+
+    def pop(self, host=None):
+        """Next entry of host, or of any host if None. Returns None if there is none left"""
+        for host in [host] if host is not None else list(self.queues):
+            queue = self.queues.get(host)
+
+            # entries whose url was removed are left in the queue and skipped here
+            entry = None
+            while queue and entry is None:
+                entry = self.take(queue)
+                if entry.url not in self.urls:
+                    entry = None
+
+            if not queue:
+                self.queues.pop(host, None)
+            if entry is not None:
+                self.urls.remove(entry.url)
+                return entry
+        return None
+
+    def remove(self, url):
+        self.urls.discard(url)
+
+
+class JsonListing:
+    """Listing backend of the json storage api, a folder url returns its path, its repo and its children"""
+    # the regex is matched against the name of the files
+    regex_field = 'name'
+
+    def parse(self, engine, folder, res):
+        """Yields the children of the folder from the streamed response res"""
+        length = res.headers.get('Content-Length', '')
+        # the length of an encoded listing is the one of the compressed bytes, which says little about the json
+        encoded = res.headers.get('Content-Encoding', 'identity').lower() != 'identity'
+        json_text, children = parse_listing(res.raw, int(length) if length.isdigit() and not encoded else None)
+
+        # the folder field may come after the children in the document, so only an explicit false means a file
+        if json_text.get("folder") is False:
+            logging.warning(f'Not a folder: {folder.url}')
+            return
+
+        for child in children:
+            name = child.get("name")
+            yield Entry(folder.url + "/" + name, json_text["path"] + "/" + name, name, bool(child.get("folder")),
+                        child.get("size"), child.get("lastModified"), json_text.get("repo"))
+
+    def compact(self, folder, entry):
+        """The child entry of the folder as kept between the syncs of watch mode, without its url nor its path"""
+        return (entry.name, entry.folder, entry.size, entry.last_modified,
+                sys.intern(entry.path[:-len(entry.name) - 1]), entry.repo)
+
+    def expand(self, folder, row):
+        """The child entry of the folder kept by compact"""
+        name, is_folder, size, last_modified, path, repo = row
+        return Entry(folder.url + "/" + name, path + "/" + name, name, is_folder, size, last_modified, repo)
+
+    def download_url(self, engine, entry):
+        return f'{engine.download_url_path}?repoKey={entry.repo}&path={entry.path.replace("/", "%252F")}'
+
+    def archive_url(self, engine, folder):
+        """Url of the folder as a zip generated by the server, None if it can't be downloaded that way"""
+        if not engine.download_folder_url_path or folder.repo is None:
+            return None
+        return (f'{engine.download_folder_url_path}?repoKey={folder.repo}&path={folder.path.replace("/", "%252F")}'
+                f'&archiveType=zip')
+
+
+class HtmlListing:
+    """Listing backend of html autoindex pages, where each link is followed by the date and the size of the file"""
+    # the regex is matched against the whole url of the files
+    regex_field = 'url'
+
+    def parse(self, engine, folder, res):
+        """Yields the links of the page in the response res, the ones ending in a slash are folders"""
+        if "text/html" not in res.headers.get("content-type", ""):
+            logging.warning(f'Not an html page: {folder.url}')
+            return
+
+        for url, size, last_modified in get_linked_urls(folder.url, res.text):
+            yield self.entry(url, size, last_modified)
+
+    @staticmethod
+    def entry(url, size, last_modified):
+        path = unquote(urlparse(url).path)
+        return Entry(url, path, os.path.basename(path.rstrip('/')), url.endswith('/'), size, last_modified)
+
+    def compact(self, folder, entry):
+        """The child entry of the folder as kept between the syncs of watch mode, its url relative to the folder if it can be"""
+        relative = entry.url.startswith(folder.url)
+        return relative, entry.url[len(folder.url):] if relative else entry.url, entry.size, entry.last_modified
+
+    def expand(self, folder, row):
+        """The child entry of the folder kept by compact"""
+        relative, url, size, last_modified = row
+        return self.entry(folder.url + url if relative else url, size, last_modified)
+
+    def download_url(self, engine, entry):
+        return entry.url
+
+    def archive_url(self, engine, folder):
+        # autoindex servers don't generate archives
+        return None
+
+
+class Naming:
+    """Decides where the files are saved and how they are tracked in the metadata.
+    By default every file is saved in the download folder under its name, with a postfix if the name is taken"""
+
+    def key(self, engine, entry):
+        """The key of the entry in the metadata"""
+        return entry.path
+
+    def admit_folder(self, engine, entry, key):
+        """If the folder should be listed"""
+        return True
+
+    def is_downloaded(self, engine, entry, key):
+        """If the local version of the file is identical to the one on the server"""
+        record = engine.meta_data.get(key)
+        return record is not None and is_same_file(record, entry.size, entry.last_modified)
+
+    def local_name(self, engine, entry, key):
+        """Path of the file, relative to the download folder, for a new download"""
+        record = engine.meta_data.get(key)
+        if record is None:
+            return add_unique_postfix(engine.download_folder, entry.name)
+        return record["name"]
+
+    def local_file(self, engine, key, record):
+        """Path relative to the download folder of a file in the metadata, None if the record isn't a file"""
+        return record.get("name")
+
+    def finish(self, engine):
+        """Called at the end of every crawl"""
+
+    def save_state(self):
+        """Json serializable state needed to resume an interrupted crawl"""
+        return None
+
+    def load_state(self, state):
+        """Restores the state returned by save_state"""
+
+
+class MirrorNaming(Naming):
+    """The files are saved under the same path they have on the server"""
+
+    def is_downloaded(self, engine, entry, key):
+        if key not in engine.meta_data:
+            # files downloaded before the metadata existed are kept if their size didn't change
+            try:
+                local_size = os.path.getsize(os.path.join(engine.download_folder, key.lstrip('/')))
+            except OSError:
+                return False
+
+            logging.info(f'Local size: {local_size}; Server size: {entry.size}')
+            if local_size != parse_size(entry.size):
+                return False
+            engine.meta_data[key] = {"name": key.lstrip('/'), "size": entry.size, "lastModified": entry.last_modified}
+
+        return super().is_downloaded(engine, entry, key)
+
+    def local_name(self, engine, entry, key):
+        return key.lstrip('/')
+
+
+class PatchIdNaming(Naming):
+    """Review folders are named <name>-<patch_id>, only the newest patch of each is downloaded,
+    into a folder named without the patch id"""
+
+    def key(self, engine, entry):
+        # the path below the root the entry was found under, whatever root is listed first.
+        # The children are named like in their url, so the end of the url is the end of the path
+        root = max((root.url for root in engine.roots if entry.url.startswith(root.url + '/')), key=len,
+                   default=entry.url.rsplit('/', 1)[0])
+        return entry.path[len(entry.path) - len(entry.url) + len(root):].split('/', 1)[1]
+
+    def admit_folder(self, engine, entry, key):
+        # only the top level folders carry a patch id
+        path, _, patch_id = key.rpartition('-')
+        if '/' in key or not path or not patch_id.isdigit():
+            return True
+        patch_id = int(patch_id)
+
+        # verify if the folder name (wo patch_id) exists, if it doesnt create a new one
+        download_loc = os.path.join(engine.download_folder, path)
+        if not os.path.exists(download_loc):
+            os.makedirs(download_loc)
+            os.chmod(download_loc, 666)
+            engine.meta_data.pop(path, None)
+
+        # the folder is new, or it was created outside of this program, thus having no metadata
+        if engine.meta_data.get(path) is None:
+            engine.meta_data[path] = {
+                "patch_id": patch_id,
+                "url": entry.url
+            }
+            return True
+
+        record = engine.meta_data[path]
+        if record["patch_id"] < patch_id:
+            logging.info(f"Found new patch {patch_id} for {path}")
+            # the previous patch isn't listed anymore
+            engine.frontier.remove(record["url"])
+            record["patch_id"] = patch_id
+            record["url"] = entry.url
+            return True
+        return record["patch_id"] == patch_id
+
+    def local_name(self, engine, entry, key):
+        return remove_patch_id(key)
+
+    def local_file(self, engine, key, record):
+        if record.get("lastModified") is None:
+            return None
+        return remove_patch_id(key)
+
+    def finish(self, engine):
+        self.remove_empty_folders(engine, engine.download_folder)
+
+    def remove_empty_folders(self, engine, path_abs):
+        walk = list(os.walk(path_abs))
+        for path, _, _ in walk[::-1]:
+            if len(os.listdir(path)) == 0:
+                os.rmdir(path)
+                try:
+                    del engine.meta_data[os.path.relpath(path, path_abs)]
+                except KeyError:
+                    pass
+
+
+class CrawlEngine:
+    def __init__(self, listing, naming, urls=None, accepted_domains=None, download_folder='download/', verify=True,
+                 username='', password='', login=True, login_url='', download_url_path='', regex='', webhook_url='',
+                 webhook_download_link='', files_remaining=-1, prune_folders=False, session_path=None,
+                 state_path=None, max_workers=4, max_per_host=2, host_delay=0.0, status_path=None,
+                 progress_interval=2.0, post_process=None, post_workers=2,
+                 include_folders=None, exclude_folders=None, record_path=None, record_downloads=False,
+                 traversal='bfs', adaptive_concurrency=False, download_folder_url_path='', archive_min_files=20,
+                 archive_max_size=2 ** 20, archive_ratio=0.8):
+        """Constructs all necessary atributes, and generates the environment for the crawler
+
+        Parameters
+        ----------
+            listing: JsonListing or HtmlListing
+                how the folders are listed and the files downloaded
+            naming: Naming
+                where the files are saved and how they are tracked in the metadata
+            urls : list(str)
+                list of the urls to be crawler
+            accepted_domains: list(str)
+                list of the accepted domains the crawler is alowed to go into
+            download_folder: str
+                folder in which the crawler will download the files
+            verify: bool
+                SSL Cert Verification used by the requests library
+            login: bool
+                if login is true the crawler will try to authentificate with username and password at the login_url
+            files_remaining: int
+                if positive, only the files_remaining newest files of the whole crawl are kept
+            prune_folders: bool
+                if true, the folders older than the kept files are not listed anymore
+                (the server has to update the lastModified of a folder when its content changes)
+            session_path: str
+                file in which the session cookies are kept between runs, by default a private file in the user cache
+            state_path: str
+                if given, the visited urls and the frontier are kept in a database at this path instead of the memory,
+                so crawls larger than the memory are possible and an interrupted crawl resumes where it stopped
+            max_workers: int
+                number of requests in flight over all the hosts
+            max_per_host: int
+                number of requests in flight to the same host
+            host_delay: float
+                minimum seconds between the start of two requests to the same host
+            status_path: str
+                if given, a json with the state and the progress of the crawler is kept at this path
+            progress_interval: float
+                seconds between two reports of the progress, on the terminal and in the status file
+            post_process: list
+                processors run on the files while they are downloaded, their results are saved in the metadata:
+                "extract", the name of a hashlib algorithm, {"callback": "module:function"} or Processor instances
+            post_workers: int
+                number of threads running the processors once their download finished,
+                on top of the threads of the downloads in flight
+            include_folders: list(str)
+                if given, only the folders matching one of these globs (or regexes prefixed with "re:"),
+                the folders below them and the folders leading to them are listed
+            exclude_folders: list(str)
+                the folders matching one of these globs or regexes are not listed, nor anything below them
+            record_path: str
+                if given, the listings are recorded with their timings in a database at this path, to be replayed by replay.py
+            record_downloads: bool
+                if true, the status, size and timings of the downloads are recorded too
+            traversal: str
+                order in which the folders and files are visited: "bfs", "dfs" or "best-first" (newest lastModified first)
+            adaptive_concurrency: bool
+                if true, the number of requests in flight to each host starts at max_per_host and adapts to the
+                latency and the 429/503 responses of the host, up to max_workers
+            download_folder_url_path: str
+                if given, the endpoint of the server returning a folder as a zip, the folders without subfolders in which
+                at least archive_min_files files, and archive_ratio of all their files and of their bytes, changed,
+                none of them above archive_max_size bytes, are downloaded as one archive instead of file by file
+        """
+        if accepted_domains is None:
+            accepted_domains = []
+        if urls is None:
+            urls = []
+
+        self.listing = listing
+        self.naming = naming
+        self.webhook_url = webhook_url
+        self.webhook_download_link = webhook_download_link
+
+        self.files_kept = files_remaining or -1
+        # the newest files of the crawl, they are only queued for download after every folder was listed
+        self.newest_files = NewestFiles(self.files_kept) if self.files_kept > 0 else None
+        self.prune_folders = prune_folders
+        self.folder_rules = FolderRules(include_folders or (), exclude_folders or ())
+        # listings skipped by the folder rules during the current sync
+        self.pruned_listings = 0
+        self.flag = False
+
+        self.roots = [Entry(url) for url in urls]
+        self.traversal = traversal
+        self.state = CrawlState(state_path, Entry, get_host, traversal=traversal, priority=newest_first) \
+            if state_path else None
+        self.adaptive_concurrency = adaptive_concurrency
+        if adaptive_concurrency:
+            self.scheduler = AdaptiveScheduler(max_per_host, host_delay, max_limit=max_workers)
+        else:
+            self.scheduler = HostScheduler(max_per_host, host_delay)
+        self.max_workers = max_workers
+        # guards the frontier, the metadata and the naming, which the worker threads share
+        self.lock = threading.RLock()
+        # host of the frontier entry each worker thread visits, the feedback of its requests goes to it
+        self.visiting = threading.local()
+
+        if self.state is not None and self.state.frontier:
+            self.resume_crawl()
+        else:
+            self.reset_crawl()
+        self.accepted_domains = get_domains(accepted_domains, urls)
+        self.download_url_path = download_url_path
+        self.download_folder_url_path = download_folder_url_path
+        self.archive_min_files = archive_min_files
+        self.archive_max_size = archive_max_size
+        self.archive_ratio = archive_ratio
+        self.download_folder = download_folder
+        self.verify = verify
+        self.re_prog = re.compile(regex)
+        self.session = requests.session()
+        # one pooled connection per worker
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=max_workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self.login_url = login_url
+        self.username = username
+        self.password = password
+        self.can_login = login
+        # set when the session was still rejected after logging in again, so the next rejection doesn't retry
+        self.login_rejected = False
+        # number of logins, so the threads rejected by the same expired session log in only once
+        self.logins = 0
+        self.login_lock = threading.Lock()
+        self.session_path = session_path or session_file(login_url, username)
+
+        # reuse the session of a previous run if it is still valid, the server is only asked for a new one on a 401/403
+        if login and not load_cookies(self.session.cookies, self.session_path):
+            self.login()
+
+        self.meta_path = os.path.join(self.download_folder, "meta.json")
+        self.meta_data = MetaStore()
+        self.temp_meta_data = MetaStore()
+
+        # open the json metadata file, if it doesn't exist create it
+        if not os.path.exists(self.meta_path):
+            os.makedirs(self.download_folder, exist_ok=True)
+            Path(self.meta_path).touch(666, exist_ok=True)
+            os.chmod(self.meta_path, 666)
+        else:
+            self.meta_data = MetaStore.load(self.meta_path)
+
+        self.post_processing = PostProcessing(post_process, post_workers, max_workers) if post_process else None
+        self.recorder = Recorder(record_path, record_downloads) if record_path else None
+
+        # progress of the current sync, reported every progress_interval seconds
+        self.progress = Progress()
+        self.progress_interval = progress_interval
+        self.progress_snapshot = None
+        self.progress_logged = 0
+
+        # state of the watch mode: listings cached between syncs and the status reported to status_path
+        self.listings = None
+        self.status_path = status_path
+        self.status_time = 0
+        self.last_sync = None
+        self.syncs = 0
+        self.stop_event = threading.Event()
+
+        def signal_handler(sig, frame):
+            self.flag = True
+            self.stop_event.set()
+
+        signal.signal(signal.SIGINT, signal_handler)
+
+    def reset_crawl(self):
+        """Starts the crawl over from the urls given in the constructor"""
+        if self.state is not None:
+            self.state.clear()
+            self.frontier, self.visited_urls = self.state.frontier, self.state.seen
+        else:
+            self.frontier, self.visited_urls = Frontier(traversal=self.traversal), set()
+
+        for root in self.roots:
+            self.frontier.push(root)
+
+    def resume_crawl(self):
+        """Continues the crawl saved in the state database by save_crawl"""
+        self.frontier, self.visited_urls = self.state.frontier, self.state.seen
+        self.naming.load_state(self.state.load("naming"))
+
+        if self.newest_files is not None:
+            for last_modified, entry, key in self.state.load("newest_files", []):
+                self.newest_files.offer(last_modified, (Entry(*entry), key))
+
+    def save_crawl(self):
+        """Saves what the state database doesn't hold already, for the crawl to be resumed by resume_crawl"""
+        self.state.save("naming", self.naming.save_state())
+        if self.newest_files is not None:
+            self.state.save("newest_files", [(entry.last_modified, entry, key)
+                                             for _, (entry, key) in self.newest_files.heap])
+        self.state.commit()
+
+    def login(self):
+        """Authenticates with username and password at the login_url and persists the session cookies"""
+        # header and body of the login POST request
+        login = json.dumps({
+            "user": self.username,
+            "password": self.password,
+            "type": "login"
+        })
+        headers = {
+            'Content-Type': 'application/json',
+            'X-Requested-With': 'XMLHttpRequest'
+        }
+        logging.info(f'Logging in at: {self.login_url}')
+        self.logins += 1
+        res = self.session.post(self.login_url, headers=headers, data=login)
+
+        if res.status_code != 200:
+            logging.warning(f'Failed to log in at: {self.login_url}, status code: {res.status_code}')
+            return
+
+        save_cookies(self.session.cookies, self.session_path)
+
+    def get(self, url, **kwargs):
+        """GET request through the session of the crawler.
+        If the server rejects the session, it logs in again and retries the request once
+
+        Parameters
+        ---------
+        url: str
+            url for request
+        kwargs:
+            passed to requests
+
+        Returns
+        ---------
+        res: requests.Response
+            The response of the request
+        """
+        logins = self.logins
+        res = self.send(url, **kwargs)
+
+        if res.status_code in RELOGIN_STATUS_CODES and self.can_login and not self.login_rejected:
+            res.close()
+            with self.login_lock:
+                # another thread may have logged in again while this request was sent
+                if self.logins == logins:
+                    logging.info(f'Session rejected by: {url}, status code: {res.status_code}, logging in again')
+                    self.login()
+            res = self.send(url, **kwargs)
+            self.login_rejected = res.status_code in RELOGIN_STATUS_CODES
+        elif res.status_code == 200:
+            self.login_rejected = False
+
+        for attempt in range(THROTTLE_RETRIES if self.adaptive_concurrency else 0):
+            if res.status_code not in OVERLOAD_STATUS_CODES:
+                break
+            # the scheduler lowered the concurrency of the host, wait before asking again
+            res.close()
+            retry_after = get_retry_after(res)
+            time.sleep(retry_after if retry_after is not None else 2 ** attempt * random.uniform(0.5, 1))
+            res = self.send(url, **kwargs)
+
+        return res
+
+    def send(self, url, **kwargs):
+        """GET request through the session, the status and the latency of the response are given to the scheduler,
+        under the host the visit was scheduled for, which may differ from the one of the url (downloads, archives)"""
+        host = getattr(self.visiting, 'host', None) or get_host(url)
+        try:
+            res = self.session.get(url, verify=self.verify, **kwargs)
+        except requests.RequestException:
+            with self.lock:
+                self.scheduler.feedback(host, None, None)
+            raise
+
+        with self.lock:
+            self.scheduler.feedback(host, res.status_code, res.elapsed.total_seconds(), get_retry_after(res))
+        return res
+
+    def send_message_to_webhook(self, message):
+
+        headers = {
+            'Content-Type': 'application/json',
+        }
+        data = {"text": message}
+        res = requests.post(self.webhook_url, headers=headers, data=json.dumps(data))
+
+        if res.status_code == 200:
+            logging.info(f'Sent "{message}" to webhook')
+        else:
+            logging.info(f'Failed to send "{message}" to webhook, status code: {res.status_code}')
+
+    def open_listing(self, url):
+        """Used to request the listing of the url param without reading its body
+
+        Parameters
+        ---------
+        url: str
+            url for request
+
+        Returns
+        ---------
+        res: requests.Response
+            The streamed response, its body is parsed by the listing backend while it is read
+        """
+        headers = dict()
+        if self.listings is not None and url in self.listings:
+            # only ask for the listing if it changed since the previous sync
+            etag, last_modified = self.listings[url][0]
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+
+        start = time.monotonic()
+        res = self.get(url, stream=True, headers=headers)
+        # let urllib3 undo the content-encoding while the raw stream is read
+        res.raw.decode_content = True
+
+        if self.recorder is not None:
+            # the listing is read whole to be recorded, then parsed from memory
+            body = res.raw.read()
+            self.recorder.listing(res, body, time.monotonic() - start)
+            res.raw = io.BytesIO(body)
+
+        return res
+
+    def list_folder(self, folder):
+        """Yields the children of the folder entry, parsed while the listing is streamed
+
+        Parameters
+        ---------
+        folder: Entry
+            the folder to list
+        """
+        res = self.open_listing(folder.url)
+
+        with res:
+            if res.status_code == 304 and self.listings is not None and folder.url in self.listings:
+                for row in self.listings[folder.url][1]:
+                    yield self.listing.expand(folder, row)
+                return
+
+            if res.status_code != 200:
+                logging.warning(f'Failed to crawl to: {folder.url}, status code: {res.status_code}')
+                return
+
+            logging.info(f'Crawling: {folder.url}')
+            children = self.listing.parse(self, folder, res)
+
+            validators = (res.headers.get('ETag'), res.headers.get('Last-Modified'))
+            if self.listings is None or not any(validators):
+                yield from children
+                return
+
+            # watch mode, keep the listing to answer the next sync if the server says it didn't change,
+            # in the compact form of the listing backend and only once it was read to its end
+            rows = []
+            for child in children:
+                rows.append(self.listing.compact(folder, child))
+                yield child
+            self.listings[folder.url] = (validators, rows)
+
+    def add_url_to_visit(self, entry):
+        """When an entry is to be added it verifies if it's domain is in the list of acceptable domains
+        and if it hasn't been visited, or hasn't been added to the frontier
+
+        Parameters
+        ----------
+        entry: Entry
+            the file or folder found in a listing
+        """
+        if not self.is_new(entry):
+            return
+
+        key = self.naming.key(self, entry)
+
+        if entry.folder:
+            if self.folder_rules and not self.folder_rules.admits(entry.path):
+                logging.info(f'Skipped url: {entry.url} (excluded by the folder rules)')
+                self.pruned_listings += 1
+                return
+
+            if self.newest_files is not None and self.prune_folders and \
+                    not self.newest_files.may_contain_newer(entry.last_modified):
+                logging.info(f'Skipped url: {entry.url} (older than the newest {self.files_kept} files)')
+                return
+
+            if self.naming.admit_folder(self, entry, key):
+                self.frontier.push(entry)
+        else:
+            # skip if the url doesn't match the given regex pattern
+            if not self.matches_regex(entry):
+                logging.info(f'Skipped url: {entry.url} (incompatible with the regex)')
+                return
+
+            if self.newest_files is not None:
+                # the file is only considered once it is known to be among the newest of the whole crawl
+                self.newest_files.offer(entry.last_modified, (entry, key))
+                return
+
+            self.add_file_to_download(entry, key)
+
+    def is_new(self, entry):
+        """If the entry is in an accepted domain, and wasn't visited nor added to the frontier yet"""
+        return entry.url not in self.visited_urls and entry.url not in self.frontier and \
+            get_domain(entry.url) in self.accepted_domains
+
+    def matches_regex(self, entry):
+        return self.re_prog.pattern == "" or bool(self.re_prog.fullmatch(getattr(entry, self.listing.regex_field)))
+
+    def add_file_to_download(self, entry, key):
+        """Adds a file to the frontier, if it differs from the already downloaded version
+
+        Parameters
+        ----------
+        entry: Entry
+            the file found in a listing
+        key: str
+            the key of the file in the metadata
+        """
+        logging.info(f"Server Last Modified: {entry.last_modified}, Server Size: {entry.size}")
+        if self.meta_data.get(key) is not None:
+            logging.info(
+                f"Client Last Modified: {self.meta_data[key].get('lastModified')}, Client Size : {self.meta_data[key].get('size')}")
+
+        if self.naming.is_downloaded(self, entry, key):
+            logging.info(f"File {key} is identical.")
+            return
+
+        logging.info(f'Adding: {entry.url}')
+        self.frontier.push(entry)
+        self.temp_meta_data[key] = self.plan_download(entry, key)
+        self.progress.plan(parse_size(entry.size))
+
+    def plan_download(self, entry, key):
+        """The metadata of the file once it is downloaded"""
+        return {
+            "name": self.naming.local_name(self, entry, key),
+            "size": entry.size,
+            "lastModified": entry.last_modified
+        }
+
+    def download_and_save(self, url, download_loc, size=-1, key=None):
+        """Downloads url to download_loc, the processors get the file while it is written,
+        and their results go to the metadata of key"""
+        logging.info(f"Downloading from: {url}")
+        transfer = self.progress.start(os.path.relpath(download_loc, self.download_folder), size)
+        succeeded = False
+
+        try:
+            start = time.monotonic()
+            res = self.get(url, stream=True)
+
+            if res.status_code != 200:
+                logging.warning(f'Failed to download: {url}, status code: {res.status_code}')
+                res.close()
+                if self.recorder is not None:
+                    self.recorder.download(res, 0, time.monotonic() - start)
+                return False
+
+            with res:
+                self.save_chunks(res.iter_content(chunk_size=2 ** 20), download_loc, transfer, key)
+            if self.recorder is not None:
+                self.recorder.download(res, transfer.done, time.monotonic() - start)
+            logging.info(f"Finished downloading from: {url} to: {download_loc}")
+            succeeded = True
+            return True
+        finally:
+            self.progress.finish(transfer, succeeded)
+
+    def save_chunks(self, chunks, download_loc, transfer, key=None):
+        """Writes the chunks of a file to download_loc, counting them in transfer,
+        the processors get the file while it is written and their results go to the metadata of key"""
+        job = None
+        succeeded = False
+
+        try:
+            # create folder for the download location
+            if not os.path.exists(dir_path := os.path.dirname(download_loc)):
+                os.makedirs(dir_path, exist_ok=True)
+                os.chmod(dir_path, 666)
+
+            if self.post_processing is not None and key is not None:
+                job = self.post_processing.open(download_loc, lambda results: self.save_results(key, results))
+
+            with open(download_loc, 'wb') as f:
+                for chunk in chunks:
+                    if chunk:
+                        f.write(chunk)
+                        transfer.done += len(chunk)
+                        if job is not None:
+                            job.feed(chunk)
+            succeeded = True
+        finally:
+            if job is not None:
+                job.close(succeeded)
+
+    def save_results(self, key, results):
+        """Adds the results of the processors to the metadata of the file key, downloaded or about to be"""
+        with self.lock:
+            record = self.meta_data.get(key) if key not in self.temp_meta_data else self.temp_meta_data[key]
+            if record is None:
+                return
+            for name, result in results.items():
+                record[name] = result
+
+    def download_file(self, entry):
+        """Downloads the file entry queued by add_file_to_download and moves its metadata to meta_data"""
+        with self.lock:
+            key = self.naming.key(self, entry)
+
+            if key not in self.temp_meta_data:
+                # the file was queued before the crawl was interrupted and resumed
+                if self.naming.is_downloaded(self, entry, key):
+                    return
+                self.temp_meta_data[key] = self.plan_download(entry, key)
+                self.progress.plan(parse_size(entry.size))
+            name = self.temp_meta_data[key]["name"]
+
+        if not self.download_and_save(self.listing.download_url(self, entry), os.path.join(self.download_folder, name),
+                                      parse_size(entry.size), key):
+            return
+        self.finish_download(key, name)
+
+    def finish_download(self, key, name):
+        """Announces the file downloaded at name and moves its metadata to meta_data"""
+        if self.webhook_url is not None and self.webhook_url != '':
+            self.send_message_to_webhook(f'File downloaded at: {self.webhook_download_link + name}')
+
+        with self.lock:
+            self.meta_data[key] = self.temp_meta_data.pop(key)
+
+    def plan_folder_archive(self, folder, children):
+        """Reads the children of the folder until it is known whether its changed files are worth downloading as one archive,
+        and queues them like add_file_to_download does if they are.
+
+        The archive holds every file of the folder, so it isn't used for a folder with subfolders, files of unknown size,
+        or changed files above archive_max_size, nor when fewer than archive_min_files files, or less than archive_ratio
+        of its files or of its bytes, changed. The listing is only buffered until one of the first three shows up.
+        Returns the children, the ones read and the rest of them, and the changed files with their keys, or None"""
+        if self.newest_files is not None or self.listing.archive_url(self, folder) is None:
+            return children, None
+
+        children = iter(children)
+        listed, files = [], []
+        changed_bytes = total_bytes = 0
+        for child in children:
+            listed.append(child)
+            size = parse_size(child.size)
+            if child.folder or size < 0:
+                return itertools.chain(listed, children), None
+
+            with self.lock:
+                key = self.naming.key(self, child)
+                changed = self.is_new(child) and self.matches_regex(child) and \
+                    not self.naming.is_downloaded(self, child, key)
+            if changed and size > self.archive_max_size:
+                return itertools.chain(listed, children), None
+
+            total_bytes += size
+            if changed:
+                files.append((child, key))
+                changed_bytes += size
+
+        if len(files) < self.archive_min_files or len(files) < self.archive_ratio * len(listed) or \
+                changed_bytes < self.archive_ratio * total_bytes:
+            return listed, None
+
+        with self.lock:
+            for child, key in files:
+                self.visited_urls.add(child.url)
+                self.temp_meta_data[key] = self.plan_download(child, key)
+                self.progress.plan(parse_size(child.size))
+        return listed, files
+
+    def download_folder_archive(self, folder, files):
+        """Downloads the folder as a zip and extracts the files planned by plan_folder_archive while it is read,
+        the ones that aren't in it are queued to be downloaded one by one"""
+        url = self.listing.archive_url(self, folder)
+        logging.info(f"Downloading {len(files)} files of {folder.url} as an archive from: {url}")
+        remaining = {child.name: (child, key) for child, key in files}
+
+        try:
+            start = time.monotonic()
+            res = self.get(url, stream=True)
+            with res:
+                if res.status_code != 200:
+                    logging.warning(f'Failed to download: {url}, status code: {res.status_code}')
+                    if self.recorder is not None:
+                        self.recorder.download(res, 0, time.monotonic() - start)
+                else:
+                    # a recorded archive keeps its body, so a replay extracts the same files
+                    body = [] if self.recorder is not None else None
+                    for name, data in iter_zip(Stream(keep_chunks(res.iter_content(chunk_size=2 ** 20), body))):
+                        if name.endswith('/') or os.path.basename(name) not in remaining:
+                            continue
+                        self.extract_file(*remaining[os.path.basename(name)], data)
+                        del remaining[os.path.basename(name)]
+                    if body is not None:
+                        self.recorder.archive(res, b''.join(body), time.monotonic() - start)
+        except Exception as e:
+            logging.warning(f'Failed to extract the archive of: {folder.url}; with exception: {e}')
+
+        if remaining:
+            logging.info(f'Downloading the {len(remaining)} files of {folder.url} not extracted from its archive one by one')
+            with self.lock:
+                for child, _ in remaining.values():
+                    self.frontier.push(child)
+
+    def extract_file(self, entry, key, data):
+        """Saves the file entry from the chunks data of the archive of its folder"""
+        with self.lock:
+            name = self.temp_meta_data[key]["name"]
+
+        transfer = self.progress.start(name, parse_size(entry.size))
+        succeeded = False
+        try:
+            self.save_chunks(data, os.path.join(self.download_folder, name), transfer, key)
+            succeeded = True
+        finally:
+            self.progress.finish(transfer, succeeded)
+        self.finish_download(key, name)
+
+    def visit(self, entry, host):
+        """Lists the folder entry or downloads the file entry, in a worker thread"""
+        self.visiting.host = host
+        try:
+            if entry.folder:
+                children, archived = self.list_folder(entry), None
+                if self.download_folder_url_path:
+                    children, archived = self.plan_folder_archive(entry, children)
+
+                # loop through all the children of the folder and add them to the frontier
+                for child in children:
+                    with self.lock:
+                        self.add_url_to_visit(child)
+
+                if archived:
+                    self.download_folder_archive(entry, archived)
+            else:
+                self.download_file(entry)
+        except Exception as e:
+            logging.exception(f'Failed to crawl: {entry.url}; with exception: {e}')
+        finally:
+            self.visiting.host = None
+            with self.lock:
+                self.scheduler.finished(host)
+
+    def sync(self):
+        """Crawls the frontier, while the progress is reported in the background"""
+        self.progress = Progress()
+        self.pruned_listings = 0
+        reporter = ProgressReporter(self.progress, self.progress_interval, self.report_progress)
+        reporter.start()
+
+        try:
+            self.crawl_frontier()
+            if self.post_processing is not None:
+                self.post_processing.join()
+        finally:
+            reporter.stop()
+            if sys.stderr.isatty():
+                sys.stderr.write('\n')
+        logging.info(f'Finished crawling: {format_progress(self.progress_snapshot)}')
+        if self.folder_rules:
+            logging.info(f'Listings pruned by the folder rules: {self.pruned_listings}')
+        if self.adaptive_concurrency:
+            logging.info(f'Concurrency settled at: {self.scheduler.limits()}')
+
+        if type(self.files_kept) == int and self.files_kept > 0:
+            self.clear_download_folder()
+        self.naming.finish(self)
+
+        if self.can_login:
+            # keep the cookies the server refreshed during the run for the next one
+            save_cookies(self.session.cookies, self.session_path)
+
+        if self.state is not None:
+            self.save_crawl()
+        if self.recorder is not None:
+            self.recorder.commit()
+
+    def crawl_frontier(self):
+        """Visits the frontier until it is empty, contains most of the logic necessary for the crawl"""
+        # a search of the frontier of each host in the order of the traversal, starting with the urls given in the constructor
+        # of the class. The entries are visited by a pool of threads, the scheduler picks the host of the next one
+        in_flight = set()
+        with ThreadPoolExecutor(self.max_workers) as pool:
+            while not self.flag:
+                with self.lock:
+                    host, delay = None, None
+                    if len(in_flight) < self.max_workers:
+                        host, delay = self.scheduler.next_host(self.frontier.hosts())
+
+                    # get the next entry to explore
+                    entry = self.frontier.pop(host) if host is not None else None
+                    if entry is not None:
+                        self.visited_urls.add(entry.url)
+                        self.scheduler.started(host)
+                        in_flight.add(pool.submit(self.visit, entry, host))
+                        continue
+
+                    if not self.frontier and not in_flight:
+                        if not self.newest_files:
+                            break
+
+                        # every folder was listed, so the newest files of the crawl are known
+                        for entry, key in self.newest_files.pop_all():
+                            self.add_file_to_download(entry, key)
+                        continue
+
+                if in_flight:
+                    _, in_flight = wait(in_flight, timeout=delay if delay is not None else 1,
+                                        return_when=FIRST_COMPLETED)
+                else:
+                    time.sleep(delay if delay is not None else 0.1)
+
+    def run(self):
+        """ Main function of the crawler, a single crawl of the urls given in the constructor"""
+        try:
+            self.sync()
+        finally:
+            self.close()
+
+        if self.flag:
+            self.save_meta_data()
+            sys.exit(0)
+
+    def watch(self, interval, jitter=0.1, status_path=None):
+        """Keeps the crawler running, synchronizing the urls given in the constructor every interval seconds
+        until SIGINT is received. The session, the metadata and the listings are kept in memory between syncs.
+
+        Parameters
+        ----------
+        interval: float
+            seconds between the start of two syncs
+        jitter: float
+            fraction of the interval by which each wait is randomly shortened or lengthened
+        status_path: str
+            if given, a json with the state, the last sync time, the queue depth and the progress is kept at this path
+        """
+        self.listings = dict()
+        if status_path is not None:
+            self.status_path = status_path
+
+        try:
+            while not self.flag:
+                start = time.time()
+                self.sync()
+                self.save_meta_data()
+
+                self.syncs += 1
+                self.last_sync = time.time()
+                logging.info(f'Finished sync {self.syncs} in {self.last_sync - start:.1f}s')
+                self.report_status('idle')
+
+                pause = max(0.0, interval * (1 + random.uniform(-jitter, jitter)) - (self.last_sync - start))
+                self.stop_event.wait(pause)
+                if not self.flag:
+                    self.reset_crawl()
+        finally:
+            self.close()
+
+        self.report_status('stopped')
+
+    def close(self):
+        """Closes the databases of the crawl state and of the recording, once the crawler is done"""
+        if self.state is not None:
+            self.state.close()
+        if self.recorder is not None:
+            self.recorder.close()
+
+    def report_progress(self, snapshot):
+        """Shows the progress on the terminal, or in the logs every 30 seconds when there is none,
+        and writes it to the status file"""
+        self.progress_snapshot = snapshot
+        line = format_progress(snapshot)
+
+        if sys.stderr.isatty():
+            sys.stderr.write(f'\r{line}\x1b[K')
+            sys.stderr.flush()
+        elif time.monotonic() - self.progress_logged >= 30:
+            self.progress_logged = time.monotonic()
+            logging.info(line)
+
+        self.report_status('syncing')
+
+    def report_status(self, state):
+        """Writes the status of the crawler to status_path"""
+        if self.status_path is None:
+            return
+
+        with self.lock:
+            self.status_time = time.time()
+            status = {
+                "state": state,
+                "last_sync": datetime.fromtimestamp(self.last_sync).isoformat() if self.last_sync else None,
+                "syncs": self.syncs,
+                "queue_depth": len(self.frontier),
+                "pending_downloads": len(self.temp_meta_data),
+                "pruned_listings": self.pruned_listings,
+                "concurrency": self.scheduler.limits(),
+                "progress": self.progress_snapshot,
+                "updated": datetime.fromtimestamp(self.status_time).isoformat()
+            }
+        write_status(self.status_path, status)
+
+    def save_meta_data(self):
+        self.meta_data.save(self.meta_path)
+
+    def clear_download_folder(self):
+        files = ((key, file_name, value) for key, value in self.meta_data.items()
+                 if (file_name := self.naming.local_file(self, key, value)) is not None and
+                 os.path.isfile(os.path.join(self.download_folder, file_name)))
+        files = sorted(files, key=lambda x: parse_timestamp(x[2].get('lastModified')))
+
+        for key, file_name, _ in files[:-min(self.files_kept, len(files))]:
+            try:
+                os.remove(path := os.path.join(self.download_folder, file_name))
+                del self.meta_data[key]
+                logging.info(f'Removed {path}')
+            except Exception as e:
+                logging.error(e)
+
+
+def main(crawler_class, default_config):
+    """Entry point of the scripts: the config is read from the path given as first argument, or default_config"""
+    try:
+        config = json.load(open(sys.argv[1]))
+    except (IndexError, FileNotFoundError):
+        config = json.load(open(default_config))
+
+    if config.get("logging"):
+        try:
+            os.mkdir('logs')
+        except FileExistsError:
+            pass
+
+        lista = sorted([os.path.join('logs', file) for file in os.listdir('logs') if
+                        not os.path.isdir(os.path.join('logs', file))],
+                       key=lambda x: os.path.getmtime(x))
+
+        if type(config.get("keep-logs")) == int and config["keep-logs"] < len(lista):
+            for file in lista[:-config["keep-logs"]]:
+                os.remove(file)
+
+        logfile = f"logs/debug-{datetime.today().strftime('%Y-%m-%d-%H%M%S')}.log"
+        file = Path(logfile)
+        file.touch(exist_ok=True, mode=666)
+
+        logging.basicConfig(
+            format='%(asctime)s %(levelname)s:%(message)s',
+            level=logging.INFO,
+            handlers=[
+                logging.FileHandler(logfile),
+                logging.StreamHandler()])
+
+    if config.get("download_folder") and config.get("network_user") and config.get("network_password"):
+        subprocess.call(
+            f'net use m: {config["download_folder"]} /user:{config["network_user"]} {config["network_password"]} /Y',
+            shell=True)
+
+    if config.get("replay"):
+        # crawl a recording served locally instead of the real servers
+        servers, config = start_replay(config["replay"], config, config.get("replay-latency-scale", 1.0))
+        for host, server in servers.items():
+            logging.info(f'Replaying {host} of {config["replay"]} at {server.url}')
+
+    c = crawler_class(**{arg: config[key] for arg, key in CONFIG_KEYS.items() if config.get(key) is not None})
+
+    if config.get("watch-interval"):
+        c.watch(config["watch-interval"], jitter=config.get("watch-jitter", 0.1))
+    else:
+        c.run()
+    c.save_meta_data()
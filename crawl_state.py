@@ -0,0 +1,188 @@
+import hashlib
+import json
+import logging
+import math
+import sqlite3
+
+# writes to the database are committed in batches of this size
+COMMIT_EVERY = 1000
+
+
+class BloomFilter:
+    """Set of strings answering "maybe" or "certainly not" in a fixed amount of memory.
+    False positives happen at about error_rate once capacity strings were added"""
+
+    def __init__(self, capacity=10 ** 7, error_rate=0.01):
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def positions(self, item):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        return ((first + i * second) % self.size for i in range(self.hashes))
+
+    def add(self, item):
+        for position in self.positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.positions(item))
+
+    def clear(self):
+        self.bits = bytearray(len(self.bits))
+
+
+class SeenSet:
+    """Set of the visited urls kept in the database, behind a bloom filter so most unseen urls never reach the disk"""
+
+    def __init__(self, state, capacity, error_rate):
+        self.state = state
+        self.bloom = BloomFilter(capacity, error_rate)
+
+        for url, in state.db.execute('SELECT url FROM seen'):
+            self.bloom.add(url)
+
+    def add(self, url):
+        self.bloom.add(url)
+        self.state.write('INSERT OR IGNORE INTO seen (url) VALUES (?)', (url,))
+
+    def __contains__(self, url):
+        if url not in self.bloom:
+            return False
+        return self.state.db.execute('SELECT 1 FROM seen WHERE url = ?', (url,)).fetchone() is not None
+
+    def clear(self):
+        self.bloom.clear()
+        self.state.write('DELETE FROM seen')
+
+
+# order of the entries of a host in the frontier, for each traversal of crawl_engine.Frontier
+TRAVERSAL_ORDERS = {
+    'bfs': 'id',
+    'dfs': 'id DESC',
+    'best-first': 'priority, id'
+}
+
+
+class DiskFrontier:
+    """Frontier kept in the database, so it can be larger than the memory and survive restarts.
+    It has the same interface and traversals as crawl_engine.Frontier, priority gives the sort key of best-first.
+    Like the SeenSet, the urls ever pushed are kept in a bloom filter, so most new urls are known to be absent without a query"""
+
+    def __init__(self, state, entry_class, get_host, traversal='bfs', priority=None, capacity=10 ** 7, error_rate=0.01):
+        if traversal not in TRAVERSAL_ORDERS:
+            raise ValueError(f'Unknown traversal: {traversal}, expected one of {tuple(TRAVERSAL_ORDERS)}')
+        self.state = state
+        self.entry_class = entry_class
+        self.get_host = get_host
+        self.order = TRAVERSAL_ORDERS[traversal]
+        self.priority = priority
+        # number of entries waiting for each host
+        self.counts = dict(state.db.execute('SELECT host, COUNT(*) FROM frontier GROUP BY host'))
+        # the popped urls stay in the filter, a query tells them apart
+        self.bloom = BloomFilter(capacity, error_rate)
+
+        for url, in state.db.execute('SELECT url FROM frontier'):
+            self.bloom.add(url)
+
+    def __len__(self):
+        return sum(self.counts.values())
+
+    def __contains__(self, url):
+        if url not in self.bloom:
+            return False
+        return self.state.db.execute('SELECT 1 FROM frontier WHERE url = ?', (url,)).fetchone() is not None
+
+    def hosts(self):
+        return list(self.counts)
+
+    def push(self, entry):
+        host = self.get_host(entry.url)
+        priority = self.priority(entry) if self.priority is not None else 0
+        self.state.write('INSERT INTO frontier (host, url, entry, priority) VALUES (?, ?, ?, ?)',
+                         (host, entry.url, json.dumps(entry), priority))
+        self.bloom.add(entry.url)
+        self.counts[host] = self.counts.get(host, 0) + 1
+
+    def pop(self, host=None):
+        if host is None:
+            host = next(iter(self.counts), None)
+        if host not in self.counts:
+            return None
+
+        row_id, entry = self.state.db.execute(f'SELECT id, entry FROM frontier WHERE host = ? ORDER BY {self.order} LIMIT 1',
+                                              (host,)).fetchone()
+        self.state.write('DELETE FROM frontier WHERE id = ?', (row_id,))
+        self.discount(host, 1)
+        return self.entry_class(*json.loads(entry))
+
+    def remove(self, url):
+        self.discount(self.get_host(url), self.state.write('DELETE FROM frontier WHERE url = ?', (url,)).rowcount)
+
+    def discount(self, host, count):
+        if count:
+            self.counts[host] -= count
+            if self.counts[host] == 0:
+                del self.counts[host]
+
+    def clear(self):
+        self.state.write('DELETE FROM frontier')
+        self.counts = dict()
+        self.bloom.clear()
+
+
+class CrawlState:
+    """Visited urls, frontier and other state of a crawl, kept in a sqlite database at path
+    so an interrupted crawl can resume where it stopped"""
+
+    def __init__(self, path, entry_class, get_host, capacity=10 ** 7, error_rate=0.01, traversal='bfs', priority=None):
+        self.path = path
+        # the crawler threads use the connection in turns, under the lock of the crawler
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS seen (url TEXT PRIMARY KEY) WITHOUT ROWID')
+        self.db.execute('CREATE TABLE IF NOT EXISTS frontier '
+                        '(id INTEGER PRIMARY KEY AUTOINCREMENT, host TEXT, url TEXT, entry TEXT, priority INTEGER DEFAULT 0)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS frontier_url ON frontier (url)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS frontier_host ON frontier (host, id)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS frontier_priority ON frontier (host, priority, id)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS saved (name TEXT PRIMARY KEY, value TEXT)')
+        self.db.commit()
+        self.writes = 0
+
+        self.seen = SeenSet(self, capacity, error_rate)
+        self.frontier = DiskFrontier(self, entry_class, get_host, traversal, priority, capacity, error_rate)
+
+        if self.frontier:
+            logging.info(f'Resuming the crawl saved in {path}, {len(self.frontier)} urls left to visit')
+
+    def write(self, query, params=()):
+        cursor = self.db.execute(query, params)
+        self.writes += 1
+        if self.writes % COMMIT_EVERY == 0:
+            self.db.commit()
+        return cursor
+
+    def save(self, name, value):
+        """Saves a json serializable value under name"""
+        self.write('INSERT OR REPLACE INTO saved (name, value) VALUES (?, ?)', (name, json.dumps(value)))
+
+    def load(self, name, default=None):
+        row = self.db.execute('SELECT value FROM saved WHERE name = ?', (name,)).fetchone()
+        return default if row is None else json.loads(row[0])
+
+    def clear(self):
+        """Forgets the crawl, once it finished"""
+        self.seen.clear()
+        self.frontier.clear()
+        self.write('DELETE FROM saved')
+        self.db.commit()
+
+    def commit(self):
+        self.db.commit()
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
@@ -0,0 +1,358 @@
+import hashlib
+import heapq
+import io
+import itertools
+import json
+import os
+import re
+import sys
+import time
+from datetime import datetime, timezone
+from fnmatch import fnmatchcase
+from urllib.parse import urlparse
+
+try:
+    # incremental parser, it picks its fastest (C) backend on its own when available
+    import ijson
+except ImportError:
+    ijson = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# listings smaller than this (in bytes) are decoded at once, which is faster than streaming them
+WHOLE_LISTING_SIZE = 2 ** 20
+
+# status codes returned by the server when the session is no longer valid
+RELOGIN_STATUS_CODES = (401, 403)
+
+# dates written by the nginx and apache autoindex pages
+AUTOINDEX_DATE_FORMATS = ('%d-%b-%Y %H:%M', '%Y-%m-%d %H:%M', '%d-%b-%Y %H:%M:%S')
+
+# units of the shortened sizes of autoindex pages
+SIZE_UNITS = {'K': 2 ** 10, 'M': 2 ** 20, 'G': 2 ** 30, 'T': 2 ** 40}
+
+# ijson events that carry a complete value
+SCALAR_EVENTS = ('null', 'boolean', 'integer', 'double', 'number', 'string')
+
+
+def add_unique_postfix(loc, fn):
+    """
+    Given a filename and a location it checks if the file exists, and if it does it adds a unique postfix
+    If the file doesn't exist it simply return its name
+    """
+    path = os.path.join(loc, fn)
+
+    if not os.path.exists(path):
+        return fn
+
+    name, ext = os.path.splitext(fn)
+
+    make_fn = lambda i: os.path.join(loc, '%s(%d)%s' % (name, i, ext))
+
+    for i in range(1, sys.maxsize):
+        uni_fn = make_fn(i)
+        if not os.path.exists(uni_fn):
+            return os.path.split(uni_fn)[1]
+
+
+def get_domain(url):
+    """The scheme and the host of the url, the form in which accepted_domains are given"""
+    return '{uri.scheme}://{uri.netloc}/'.format(uri=urlparse(url))
+
+
+def get_domains(accepted_domains, urls):
+    """
+    If accepted_domains is empty, create it from the domains of all the urls given as input
+    """
+    if len(accepted_domains) == 0:
+        for url in urls:
+            accepted_domains.append(get_domain(url))
+    return accepted_domains
+
+
+def loads(data):
+    """Decode a json document (str or bytes) with the fastest decoder that is installed"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def session_file(login_url, username):
+    """Default location of the persisted session of username at login_url, in the cache folder of the current user"""
+    cache = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    key = hashlib.sha256(f'{login_url}\n{username}'.encode()).hexdigest()[:16]
+    return os.path.join(cache, 'download-crawler', f'session-{key}.json')
+
+
+def load_cookies(cookie_jar, path):
+    """Adds the cookies persisted at path that haven't expired yet to cookie_jar, returns if any was loaded"""
+    try:
+        with open(path) as f:
+            cookies = json.load(f)
+    except (OSError, ValueError):
+        return False
+
+    now = time.time()
+    loaded = 0
+    for cookie in cookies:
+        if cookie.get("expires") is not None and cookie["expires"] <= now:
+            continue
+        cookie_jar.set(cookie["name"], cookie["value"], domain=cookie["domain"], path=cookie["path"],
+                       secure=cookie["secure"], expires=cookie.get("expires"))
+        loaded += 1
+    return loaded > 0
+
+
+def save_cookies(cookie_jar, path):
+    """Persists the cookies of cookie_jar at path, in a file only the current user can read"""
+    os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+    cookies = [{
+        "name": cookie.name,
+        "value": cookie.value,
+        "domain": cookie.domain,
+        "path": cookie.path,
+        "secure": cookie.secure,
+        "expires": cookie.expires
+    } for cookie in cookie_jar]
+
+    # write a private temporary file first, so the session is never readable by others nor half written
+    temp_path = path + '.tmp'
+    with os.fdopen(os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as f:
+        json.dump(cookies, f)
+    os.replace(temp_path, path)
+
+
+def write_status(path, status):
+    """Writes the status dict as json at path, replacing the previous status at once so readers never see half of it"""
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump(status, f)
+    os.replace(temp_path, path)
+
+
+def parse_timestamp(value):
+    """Converts the lastModified of a listing (iso date, autoindex date or epoch milliseconds) to epoch milliseconds.
+    Missing or unknown values are considered the oldest possible."""
+    if value is None or isinstance(value, bool):
+        return 0
+    if isinstance(value, (int, float)):
+        return int(value)
+
+    try:
+        return int(value)
+    except ValueError:
+        pass
+
+    try:
+        return round(datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp() * 1000)
+    except ValueError:
+        pass
+
+    for date_format in AUTOINDEX_DATE_FORMATS:
+        try:
+            return round(datetime.strptime(value, date_format).replace(tzinfo=timezone.utc).timestamp() * 1000)
+        except ValueError:
+            pass
+    return 0
+
+
+def parse_size(value):
+    """Converts the size of a listing to bytes, the sizes shortened by autoindex pages (1.2K, 3M) are expanded.
+    Returns -1 if the size is unknown"""
+    if value is None or isinstance(value, bool):
+        return -1
+    if isinstance(value, (int, float)):
+        return int(value)
+
+    value = value.strip()
+    try:
+        return int(value)
+    except ValueError:
+        pass
+
+    try:
+        return int(float(value[:-1]) * SIZE_UNITS[value[-1].upper()])
+    except (IndexError, KeyError, ValueError):
+        return -1
+
+
+class NewestFiles:
+    """Keeps the count newest files offered during a crawl, in a min-heap bounded to count entries"""
+
+    def __init__(self, count):
+        self.count = count
+        self.heap = []
+        # ties are won by the file seen first
+        self.order = itertools.count()
+
+    def __len__(self):
+        return len(self.heap)
+
+    def offer(self, last_modified, file):
+        """Adds the file if it is newer than the oldest one kept, returns if it was kept"""
+        key = (parse_timestamp(last_modified), -next(self.order))
+
+        if len(self.heap) < self.count:
+            heapq.heappush(self.heap, (key, file))
+            return True
+
+        if key > self.heap[0][0]:
+            heapq.heapreplace(self.heap, (key, file))
+            return True
+        return False
+
+    def may_contain_newer(self, last_modified):
+        """If a folder modified at last_modified can still hold a file newer than the ones kept"""
+        return len(self.heap) < self.count or parse_timestamp(last_modified) >= self.heap[0][0][0]
+
+    def pop_all(self):
+        """Returns the files kept, newest first, and empties the heap"""
+        files = [file for _, file in sorted(self.heap, key=lambda x: x[0], reverse=True)]
+        self.heap = []
+        return files
+
+
+def match_glob(pattern, parts, partial=False):
+    """If the path segments parts match the glob segments pattern, where "**" stands for any number of segments.
+    If partial, running out of parts is a match too, since the rest of the pattern may match below them"""
+    if not parts:
+        return partial or all(segment == '**' for segment in pattern)
+    if not pattern:
+        return False
+    if pattern[0] == '**':
+        return match_glob(pattern[1:], parts, partial) or match_glob(pattern, parts[1:], partial)
+    return fnmatchcase(parts[0], pattern[0]) and match_glob(pattern[1:], parts[1:], partial)
+
+
+class FolderRules:
+    """Include and exclude rules on the paths of the folders, checked before a folder is queued for listing.
+
+    A rule is a glob on the path of the folder without its leading and trailing slash ("*" matches in one segment,
+    "**" any number of segments), or a regex on that path when it starts with "re:".
+    A folder is skipped if an exclude rule matches it. When there are include rules, a folder is only listed
+    if one of them matches it or one of its parents or, for a glob, could match a folder below it.
+    """
+
+    def __init__(self, include=(), exclude=()):
+        self.include = [self.compile(rule) for rule in include]
+        self.exclude = [self.compile(rule) for rule in exclude]
+
+    @staticmethod
+    def compile(rule):
+        if rule.startswith('re:'):
+            return re.compile(rule[3:])
+        return rule.strip('/').split('/')
+
+    @staticmethod
+    def includes(rule, parts):
+        if isinstance(rule, list):
+            return match_glob(rule + ['**'], parts, partial=True)
+        return any(rule.fullmatch('/'.join(parts[:depth])) for depth in range(1, len(parts) + 1))
+
+    @staticmethod
+    def excludes(rule, parts):
+        if isinstance(rule, list):
+            return match_glob(rule, parts)
+        return rule.fullmatch('/'.join(parts)) is not None
+
+    def __bool__(self):
+        return bool(self.include or self.exclude)
+
+    def admits(self, path):
+        """If the folder at path on the server should be listed"""
+        parts = path.strip('/').split('/')
+        if any(self.excludes(rule, parts) for rule in self.exclude):
+            return False
+        return not self.include or any(self.includes(rule, parts) for rule in self.include)
+
+
+def parse_listing(fp, size=None):
+    """Parse the json listing read from the file-like object fp without loading the whole document,
+    unless it is smaller than WHOLE_LISTING_SIZE
+
+    Parameters
+    ----------
+    fp: file-like object
+        the body of the response, usually res.raw
+    size: int
+        the length of the body if known, its Content-Length
+
+    Returns
+    ---------
+    info: dict
+        the top level fields of the listing (path, repo, folder ...), without the children
+    children: iterator(dict)
+        the children of the folder, yielded one at a time while the stream is read
+    """
+    if ijson is None or (size is not None and 0 <= size < WHOLE_LISTING_SIZE):
+        # no incremental parser installed or a small listing, decode the bytes directly instead of building the text first
+        info = loads(fp.read())
+        children = info.pop("children", None) or []
+        return info, iter(children)
+
+    # the children are built by the C backend of ijson, the other fields are read from the beginning of the document
+    reader = RecordingReader(fp)
+    children = ijson.items(reader, 'children.item', use_float=True)
+    first = next(children, None)
+
+    if first is None:
+        # the whole document was read, it has no children
+        info = loads(reader.recorded())
+        info.pop("children", None)
+        return info, iter(())
+
+    info = _head_fields(reader.recorded())
+    if "path" in info:
+        reader.stop()
+        return info, itertools.chain([first], children)
+    return info, _iter_late_fields(first, children, reader, info)
+
+
+class RecordingReader:
+    """File-like object reading from fp, which keeps a copy of what was read until stop is called"""
+
+    def __init__(self, fp):
+        self.fp = fp
+        self.parts = []
+        self.recording = True
+
+    def read(self, size=-1):
+        data = self.fp.read(size)
+        if self.recording:
+            self.parts.append(data)
+        return data
+
+    def recorded(self):
+        return b''.join(self.parts)
+
+    def stop(self):
+        self.recording = False
+        self.parts = []
+
+
+def _head_fields(head):
+    """The top level fields written before the children, in the beginning head of a listing"""
+    info = dict()
+    try:
+        for prefix, event, value in ijson.parse(io.BytesIO(head), use_float=True):
+            if prefix == 'children' and event == 'start_array':
+                break
+            if event in SCALAR_EVENTS and prefix and '.' not in prefix:
+                info[prefix] = value
+    except ijson.IncompleteJSONError:
+        pass
+    return info
+
+
+def _iter_late_fields(first, children, reader, info):
+    """The children of a listing whose path comes after them, held back until the end of the document
+    to add the top level fields to info"""
+    pending = [first, *children]
+    document = loads(reader.recorded())
+    document.pop("children", None)
+    info.update(document)
+    yield from pending
@@ -0,0 +1,153 @@
+import time
+from collections import defaultdict, deque
+
+# status codes by which a server asks for fewer requests, None stands for a request that failed without a response
+OVERLOAD_STATUS_CODES = (None, 429, 503)
+
+
+class HostScheduler:
+    """Decides which host the next request goes to.
+
+    The hosts with entries in the frontier are served in round-robin order, each with at most max_per_host
+    requests in flight and at least min_delay seconds between the start of two requests, so a slow host
+    doesn't hold back the others and no single server gets hammered.
+    """
+
+    def __init__(self, max_per_host=2, min_delay=0.0):
+        self.max_per_host = max_per_host
+        self.min_delay = min_delay
+        self.in_flight = defaultdict(int)
+        # earliest time at which each host can be requested again
+        self.ready_at = defaultdict(float)
+        self.rotation = deque()
+
+    def limit(self, host):
+        """Number of requests host may have in flight"""
+        return self.max_per_host
+
+    def next_host(self, hosts):
+        """Picks the next host to request among hosts, the ones that have entries waiting
+
+        Returns
+        ---------
+        host: str
+            the host to request next, None if none of them can be requested now
+        wait: float
+            if no host was picked, seconds until one of them is out of its delay, None if all of them are busy
+        """
+        hosts = set(hosts)
+        for host in hosts.difference(self.rotation):
+            self.rotation.append(host)
+
+        now = time.monotonic()
+        wait = None
+        for _ in range(len(self.rotation)):
+            host = self.rotation[0]
+            self.rotation.rotate(-1)
+
+            if host not in hosts or self.in_flight[host] >= self.limit(host):
+                continue
+            if self.ready_at[host] > now:
+                wait = min(wait, self.ready_at[host] - now) if wait is not None else self.ready_at[host] - now
+                continue
+            return host, None
+        return None, wait
+
+    def feedback(self, host, status, latency, retry_after=None):
+        """Called with the status code of every response of host (None if the request failed)
+        and the seconds it took to get its headers, and the seconds of its Retry-After header if any"""
+
+    def limits(self):
+        """Number of requests each host that was requested may have in flight"""
+        return {host: self.limit(host) for host in self.in_flight}
+
+    def started(self, host):
+        self.in_flight[host] += 1
+        self.ready_at[host] = time.monotonic() + self.min_delay
+
+    def finished(self, host):
+        self.in_flight[host] -= 1
+
+
+class Window:
+    """Congestion window of a host: its limit of requests in flight and the latencies it was measured at"""
+    __slots__ = ('size', 'latency', 'base', 'responses', 'since_back_off', 'overloaded')
+
+    def __init__(self, size):
+        self.size = size
+        # moving average of the latency, and the lowest one seen, the reference its rises are measured against
+        self.latency = None
+        self.base = None
+        # responses since the size last changed, and since it was last lowered
+        self.responses = 0
+        self.since_back_off = float('inf')
+        # if the host was overloaded during the current window
+        self.overloaded = False
+
+
+class AdaptiveScheduler(HostScheduler):
+    """HostScheduler in which the limit of requests in flight of each host follows its responses (AIMD).
+
+    Each host starts at max_per_host. Once a window of responses (as many as the limit) came back with a stable latency,
+    the limit grows by one, up to max_limit. It is halved when the host answers 429 or 503, a request fails,
+    or the average latency rises tolerance times above the lowest one seen. That reference only moves up by decay
+    of the rise at each back off, so the limit doesn't grow back while the latency stays high,
+    but a host that became slower for good is eventually measured against its new latency.
+    """
+
+    def __init__(self, max_per_host=2, min_delay=0.0, max_limit=16, tolerance=1.5, slack=0.005, smoothing=0.2,
+                 decay=0.05):
+        super().__init__(max_per_host, min_delay)
+        self.max_limit = max(max_limit, max_per_host)
+        self.tolerance = tolerance
+        # seconds of latency jitter that never count as a rise, for hosts answering within milliseconds
+        self.slack = slack
+        self.smoothing = smoothing
+        self.decay = decay
+        self.windows = dict()
+
+    def window(self, host):
+        if host not in self.windows:
+            self.windows[host] = Window(self.max_per_host)
+        return self.windows[host]
+
+    def limit(self, host):
+        return self.window(host).size
+
+    def back_off(self, window):
+        window.size = max(1, window.size // 2)
+        window.responses = window.since_back_off = 0
+        window.overloaded = False
+
+    def feedback(self, host, status, latency, retry_after=None):
+        window = self.window(host)
+        window.responses += 1
+        window.since_back_off += 1
+
+        if status in OVERLOAD_STATUS_CODES:
+            if retry_after is not None:
+                self.ready_at[host] = max(self.ready_at[host], time.monotonic() + retry_after)
+            # the requests sent before the last back off answer with the old size, so they don't lower it again
+            if window.since_back_off > window.size:
+                self.back_off(window)
+            else:
+                window.overloaded = True
+            return
+
+        if window.latency is None:
+            window.latency = latency
+        else:
+            window.latency += self.smoothing * (latency - window.latency)
+        window.base = window.latency if window.base is None else min(window.base, window.latency)
+
+        if window.responses < window.size:
+            return
+
+        if window.latency > window.base * self.tolerance + self.slack:
+            self.back_off(window)
+            window.base += self.decay * (window.latency - window.base)
+        else:
+            if not window.overloaded:
+                window.size = min(window.size + 1, self.max_limit)
+            window.responses = 0
+            window.overloaded = False
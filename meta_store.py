@@ -0,0 +1,309 @@
+import json
+import os
+import re
+import sys
+from array import array
+from collections.abc import MutableMapping
+from datetime import datetime, timezone
+
+from crawl_utils import ijson, loads, parse_size, parse_timestamp, AUTOINDEX_DATE_FORMATS, SIZE_UNITS
+
+# value of the size and lastModified columns when the field is missing
+MISSING = -1
+
+
+# the formats in which the sizes and dates of the listings are written, as (kind, parameters...):
+# a number of bytes, or of units with some decimals ("1.2K" in autoindex pages),
+# an iso date (separator, seconds, digits of the fraction of seconds, offset) or one of the autoindex date formats
+SIZE_UNITS_PATTERN = re.compile(r'\d+(?:\.(\d+))?([KMGTkmgt])')
+ISO_DATE_PATTERN = re.compile(r'\d{4}-\d\d-\d\d([T ])\d\d:\d\d(:\d\d)?(?:\.(\d+))?(Z|[+-]\d\d:\d\d)?')
+# the formats numbers are written in, the ones of the Artifactory listings
+DEFAULT_FORMATS = {"size": ('bytes',), "lastModified": ('iso', 'T', True, 3, 'Z')}
+PARSERS = {"size": parse_size, "lastModified": parse_timestamp}
+
+
+def find_format(field, value):
+    """The format of the size or lastModified string value, None if it isn't one of the known ones"""
+    if field == "size":
+        if value.isdigit():
+            return 'bytes',
+        match = SIZE_UNITS_PATTERN.fullmatch(value)
+        return ('units', len(match[1] or ''), match[2]) if match else None
+
+    match = ISO_DATE_PATTERN.fullmatch(value)
+    if match:
+        return 'iso', match[1], match[2] is not None, len(match[3] or ''), match[4] or ''
+    for date_format in AUTOINDEX_DATE_FORMATS:
+        try:
+            datetime.strptime(value, date_format)
+            return 'autoindex', date_format
+        except ValueError:
+            pass
+    return None
+
+
+def write_format(value_format, value):
+    """The size in bytes or the date in epoch milliseconds value, written in value_format"""
+    kind = value_format[0]
+    if kind == 'bytes':
+        return str(value)
+    if kind == 'units':
+        _, decimals, unit = value_format
+        return f'{value / SIZE_UNITS[unit.upper()]:.{decimals}f}{unit}'
+    if kind == 'autoindex':
+        return datetime.fromtimestamp(value // 1000, timezone.utc).strftime(value_format[1])
+
+    _, separator, seconds, digits, offset = value_format
+    # dates without an offset are in local time, like parse_timestamp reads them
+    date = datetime.fromtimestamp(value // 1000, datetime.strptime(offset, '%z').tzinfo if offset else None)
+    text = date.strftime(f'%Y-%m-%d{separator}%H:%M{":%S" if seconds else ""}')
+    if digits:
+        text += '.' + f'{value % 1000:03d}'.ljust(digits, '0')[:digits]
+    return text + offset
+
+
+def stored_form(field, value):
+    """The value of a size or lastModified as a Record gives it back: strings as they were written,
+    numbers in the form of the listings"""
+    if value is None or isinstance(value, str):
+        return value
+    return write_format(DEFAULT_FORMATS[field], int(value))
+
+
+def is_same_file(record, size, last_modified):
+    """If the record describes a file of the given size and lastModified, as written in a listing"""
+    return (record.get("size") == stored_form("size", size) and
+            record.get("lastModified") == stored_form("lastModified", last_modified))
+
+
+class Record(MutableMapping):
+    """View of one row of a MetaStore, it reads and writes the row like the dict it replaces:
+    name, size and lastModified, plus any other field.
+    The size and lastModified are given back as they were written, numbers are given back as strings"""
+    __slots__ = ('store', 'row')
+
+    def __init__(self, store, row):
+        self.store = store
+        self.row = row
+
+    def __getitem__(self, field):
+        store, row = self.store, self.row
+        if field == "name":
+            value = store.names[row]
+        elif field in PARSERS:
+            raw = store.raw[field]
+            if row in raw:
+                return raw[row]
+            values, formats = store.columns[field]
+            value = values[row]
+            if value != MISSING:
+                return write_format(store.formats[field][formats[row]], value)
+        else:
+            extras = store.extras.get(row)
+            if extras is None or field not in extras:
+                raise KeyError(field)
+            return extras[field]
+
+        if value is None or value == MISSING:
+            raise KeyError(field)
+        return value
+
+    def __setitem__(self, field, value):
+        store, row = self.store, self.row
+        if field == "name":
+            store.names[row] = value
+        elif field in PARSERS:
+            values, formats = store.columns[field]
+            values[row] = MISSING if value is None else PARSERS[field](value)
+            formats[row] = 0
+            store.raw[field].pop(row, None)
+            if isinstance(value, str):
+                index = store.format_index(field, find_format(field, value))
+                if index is not None and write_format(store.formats[field][index], values[row]) == value:
+                    formats[row] = index
+                else:
+                    # the few strings the columns can't give back, like unparseable dates, are kept as they are
+                    store.raw[field][row] = sys.intern(value)
+        else:
+            store.extras.setdefault(row, dict())[field] = value
+
+    def __delitem__(self, field):
+        if field not in self:
+            raise KeyError(field)
+
+        if field in ("name", "size", "lastModified"):
+            self[field] = None
+        else:
+            del self.store.extras[self.row][field]
+
+    def __iter__(self):
+        for field in ("name", "size", "lastModified"):
+            if field in self:
+                yield field
+        yield from self.store.extras.get(self.row, ())
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class MetaStore(MutableMapping):
+    """Mapping of the tracked paths to their metadata, in a compact form for crawls of millions of files.
+
+    The folder part of each path is interned and stored once, the files of a folder are indexed by their name,
+    and the name, size and lastModified of every file are kept in columns (arrays of integers for the last two,
+    with the index of the format each one was written in, among the few formats of the store).
+    The values are read and written as Record views, which behave like the dicts they replace,
+    so the sizes and dates are saved in the form they were written in.
+    """
+
+    def __init__(self, data=None):
+        # folder -> its files, file name -> row
+        self.folders = dict()
+        self.names = []
+        self.sizes = array('q')
+        self.times = array('q')
+        # the format each size and date was written in, as an index in the formats of the store
+        self.size_formats = array('B')
+        self.time_formats = array('B')
+        self.columns = {"size": (self.sizes, self.size_formats), "lastModified": (self.times, self.time_formats)}
+        self.formats = {field: [value_format] for field, value_format in DEFAULT_FORMATS.items()}
+        self.format_indexes = {field: {value_format: 0} for field, value_format in DEFAULT_FORMATS.items()}
+        # sizes and dates in none of the formats, by row
+        self.raw = {"size": dict(), "lastModified": dict()}
+        # fields other than name, size and lastModified, by row
+        self.extras = dict()
+        self.free_rows = []
+        self.count = 0
+
+        if data is not None:
+            self.update(data)
+
+    @staticmethod
+    def split(key):
+        folder, slash, name = key.rpartition('/')
+        # the trailing slash is kept with the folder, so "/a" and "a" stay different keys
+        return folder + slash, name
+
+    def format_index(self, field, value_format):
+        """Index of value_format in the formats of field, None if it is None or there are too many formats already"""
+        if value_format is None:
+            return None
+        indexes = self.format_indexes[field]
+        if value_format not in indexes:
+            if len(indexes) > 255:
+                return None
+            indexes[value_format] = len(self.formats[field])
+            self.formats[field].append(value_format)
+        return indexes[value_format]
+
+    def find(self, key):
+        folder, name = self.split(key)
+        return self.folders.get(folder, {}).get(name)
+
+    def __getitem__(self, key):
+        row = self.find(key)
+        if row is None:
+            raise KeyError(key)
+        return Record(self, row)
+
+    def __setitem__(self, key, value):
+        folder, name = self.split(key)
+        row = self.folders.get(folder, {}).get(name)
+
+        if row is None:
+            folder = sys.intern(folder)
+            if self.free_rows:
+                row = self.free_rows.pop()
+            else:
+                row = len(self.names)
+                self.names.append(None)
+                self.sizes.append(MISSING)
+                self.times.append(MISSING)
+                self.size_formats.append(0)
+                self.time_formats.append(0)
+            self.folders.setdefault(folder, dict())[name] = row
+            self.count += 1
+        elif isinstance(value, Record) and value.store is self and value.row == row:
+            return
+
+        value = dict(value)
+        record = Record(self, row)
+        local_name = value.pop("name", None)
+        # most files keep the name they have on the server, the string of the key is shared then
+        record["name"] = name if local_name == name else local_name
+        record["size"] = value.pop("size", None)
+        record["lastModified"] = value.pop("lastModified", None)
+
+        self.extras.pop(row, None)
+        if value:
+            self.extras[row] = value
+
+    def __delitem__(self, key):
+        folder, name = self.split(key)
+        files = self.folders.get(folder)
+        if files is None or name not in files:
+            raise KeyError(key)
+
+        row = files.pop(name)
+        if not files:
+            del self.folders[folder]
+
+        self.names[row] = None
+        self.sizes[row] = self.times[row] = MISSING
+        self.size_formats[row] = self.time_formats[row] = 0
+        self.extras.pop(row, None)
+        for raw in self.raw.values():
+            raw.pop(row, None)
+        self.free_rows.append(row)
+        self.count -= 1
+
+    def __iter__(self):
+        for folder, files in list(self.folders.items()):
+            for name in list(files):
+                yield folder + name
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, key):
+        return self.find(key) is not None
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({len(self)} paths)'
+
+    def pop(self, key, *default):
+        """Removes the key and returns its value as a plain dict, since the row of a removed key is reused"""
+        if key not in self:
+            if default:
+                return default[0]
+            raise KeyError(key)
+
+        value = dict(self[key])
+        del self[key]
+        return value
+
+    def save(self, path):
+        """Writes the store as a json object, one path at a time"""
+        with open(path, 'w') as f:
+            f.write('{')
+            for i, (key, record) in enumerate(self.items()):
+                f.write(f'{", " if i else ""}{json.dumps(key)}: {json.dumps(dict(record))}')
+            f.write('}')
+
+    @classmethod
+    def load(cls, path):
+        """Reads a store saved by save, sizes and dates written as numbers are saved back as strings"""
+        store = cls()
+        if os.path.getsize(path) == 0:
+            return store
+
+        with open(path, 'rb') as f:
+            if ijson is not None:
+                for key, value in ijson.kvitems(f, '', use_float=True):
+                    store[key] = value
+            else:
+                store.update(loads(f.read() or b"{}"))
+        return store
@@ -0,0 +1,403 @@
+import hashlib
+import importlib
+import logging
+import os
+import queue
+import re
+import shutil
+import struct
+import tarfile
+import threading
+import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+# chunks a processor may fall behind the download before the download waits for it
+QUEUE_CHUNKS = 8
+ARCHIVE_SUFFIXES = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+# markers put in a pipe after the last chunk
+END, ABORT = object(), object()
+
+
+class Aborted(Exception):
+    """The download fed to a processor failed, its result is discarded"""
+
+
+class Stream:
+    """Chunks of a file read like a binary file, as they arrive from chunks,
+    with unread for the parsers that read past what they needed"""
+
+    def __init__(self, chunks=()):
+        self.chunks = iter(chunks)
+        self.buffer = b''
+        self.ended = False
+
+    def fetch(self):
+        """The next chunk from the source, b'' once it ended"""
+        return next(self.chunks, b'')
+
+    def next_chunk(self):
+        """The next chunk of the file, b'' once it ended"""
+        if self.buffer:
+            chunk, self.buffer = self.buffer, b''
+            return chunk
+        if self.ended:
+            return b''
+
+        chunk = self.fetch()
+        if not chunk:
+            self.ended = True
+        return chunk
+
+    def unread(self, data):
+        self.buffer = data + self.buffer
+
+    def read(self, size=-1):
+        parts = []
+        while size != 0 and (chunk := self.next_chunk()):
+            if 0 < size < len(chunk):
+                self.unread(chunk[size:])
+                chunk = chunk[:size]
+            parts.append(chunk)
+            if size > 0:
+                size -= len(chunk)
+        return b''.join(parts)
+
+    def read_exact(self, size):
+        data = self.read(size)
+        if len(data) != size:
+            raise EOFError('the stream ended early')
+        return data
+
+    def __iter__(self):
+        while chunk := self.next_chunk():
+            yield chunk
+
+    def drain(self):
+        """Discards the rest of the file"""
+        for _ in self:
+            pass
+
+
+class Pipe(Stream):
+    """Chunks of a download on their way to one processor.
+    The download waits when the processor is QUEUE_CHUNKS chunks behind"""
+
+    def __init__(self):
+        super().__init__()
+        self.queue = queue.Queue(QUEUE_CHUNKS)
+
+    def put(self, chunk):
+        self.queue.put(chunk)
+
+    def fetch(self):
+        chunk = self.queue.get()
+        if chunk is ABORT:
+            self.ended = True
+            raise Aborted()
+        return b'' if chunk is END else chunk
+
+    def drain(self):
+        """Discards the rest of the download, so it doesn't wait for a processor that gave up"""
+        try:
+            super().drain()
+        except Aborted:
+            pass
+
+
+def safe_path(folder, name):
+    """Path of the archive member name inside folder, None if it would land outside of it"""
+    path = os.path.realpath(os.path.join(folder, name))
+    if os.path.commonpath([path, os.path.realpath(folder)]) != os.path.realpath(folder):
+        return None
+    return path
+
+
+class Processor:
+    """Work done on the bytes of a downloaded file while it is downloaded.
+
+    process reads the file from stream, as it arrives, and returns a json serializable result,
+    which is saved in the metadata of the file under name.
+    """
+    name = None
+
+    def __init__(self, pattern=''):
+        self.pattern = re.compile(pattern)
+
+    def matches(self, path):
+        return self.pattern.search(os.path.basename(path)) is not None
+
+    def process(self, stream, path):
+        raise NotImplementedError
+
+
+class HashProcessor(Processor):
+    """Checksum of the file with one of the algorithms of hashlib, as a hex string"""
+
+    def __init__(self, algorithm='sha256', pattern=''):
+        super().__init__(pattern)
+        hashlib.new(algorithm)
+        self.name = self.algorithm = algorithm
+
+    def process(self, stream, path):
+        digest = hashlib.new(self.algorithm)
+        for chunk in stream:
+            digest.update(chunk)
+        return digest.hexdigest()
+
+
+class ExtractProcessor(Processor):
+    """Extracts zip and tar archives next to them, in a folder named like the archive without its suffix.
+    The result is the extracted folder, relative to the archive, and the number of extracted files"""
+    name = "extracted"
+
+    def matches(self, path):
+        return path.lower().endswith(ARCHIVE_SUFFIXES) and super().matches(path)
+
+    @staticmethod
+    def target(path):
+        lower = path.lower()
+        suffix = next(suffix for suffix in sorted(ARCHIVE_SUFFIXES, key=len, reverse=True) if lower.endswith(suffix))
+        return path[:-len(suffix)]
+
+    def process(self, stream, path):
+        folder = self.target(path)
+        os.makedirs(folder, exist_ok=True)
+
+        if path.lower().endswith('.zip'):
+            try:
+                files = extract_zip_stream(stream, folder)
+            except (zipfile.BadZipFile, NotImplementedError, EOFError, zlib.error) as e:
+                # some archives can only be read from their central directory, at the end of the file
+                logging.info(f'Extracting {path} from the disk: {e}')
+                stream.drain()
+                files = extract_zip_file(path, folder)
+        else:
+            files = extract_tar_stream(stream, folder)
+        return {"folder": os.path.basename(folder) + '/', "files": files}
+
+
+class CallbackProcessor(Processor):
+    """Calls function(stream, path) with the stream of the downloaded file, saves what it returns"""
+
+    def __init__(self, name, function, pattern=''):
+        super().__init__(pattern)
+        self.name = name
+        self.function = function
+
+    def process(self, stream, path):
+        return self.function(stream, path)
+
+
+def extract_tar_stream(stream, folder):
+    files = 0
+    with tarfile.open(fileobj=stream, mode='r|*') as archive:
+        for member in archive:
+            if not (member.isfile() or member.isdir()) or (path := safe_path(folder, member.name)) is None:
+                logging.warning(f'Skipped archive member: {member.name}')
+                continue
+
+            if member.isdir():
+                os.makedirs(path, exist_ok=True)
+                continue
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with archive.extractfile(member) as src, open(path, 'wb') as dst:
+                shutil.copyfileobj(src, dst, 2 ** 20)
+            files += 1
+    return files
+
+
+def extract_zip_file(path, folder):
+    files = 0
+    with zipfile.ZipFile(path) as archive:
+        for member in archive.infolist():
+            if (target := safe_path(folder, member.filename)) is None:
+                logging.warning(f'Skipped archive member: {member.filename}')
+                continue
+
+            if member.is_dir():
+                os.makedirs(target, exist_ok=True)
+                continue
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with archive.open(member) as src, open(target, 'wb') as dst:
+                shutil.copyfileobj(src, dst, 2 ** 20)
+            files += 1
+    return files
+
+
+def iter_zip(stream):
+    """Reads a zip from the local headers of its members, in the order they arrive.
+    Yields the name of each member and an iterator over its bytes, the rest of which is skipped when the next member is read.
+    Raises NotImplementedError for the members that can't be read without the central directory"""
+    while stream.read(4) == b'PK\x03\x04':
+        _, flags, method, _, _, _, compressed, _, name_length, extra_length = struct.unpack(
+            '<HHHHHIIIHH', stream.read_exact(26))
+        name = stream.read_exact(name_length).decode('utf-8' if flags & 0x800 else 'cp437')
+        stream.read_exact(extra_length)
+
+        if flags & 0x1:
+            raise NotImplementedError(f'{name} is encrypted')
+        if compressed == 0xFFFFFFFF:
+            raise NotImplementedError(f'{name} is a zip64 member')
+        # the sizes are written after the data when bit 3 is set
+        descriptor = flags & 0x8
+        if method == 0 and descriptor:
+            raise NotImplementedError(f'{name} is stored without its size')
+        if method not in (0, 8):
+            raise NotImplementedError(f'{name} uses compression method {method}')
+
+        data = read_stored(stream, compressed) if method == 0 else read_deflated(stream)
+        yield name, data
+        for _ in data:
+            pass
+
+        if descriptor:
+            # crc and sizes, with an optional signature before them
+            if stream.read_exact(4) == b'PK\x07\x08':
+                stream.read_exact(4)
+            stream.read_exact(8)
+
+    # the central directory, nothing to extract from it
+    stream.drain()
+
+
+def read_stored(stream, size):
+    while size:
+        chunk = stream.read(min(size, 2 ** 20))
+        if not chunk:
+            raise EOFError('the stream ended early')
+        size -= len(chunk)
+        yield chunk
+
+
+def read_deflated(stream):
+    inflate = zlib.decompressobj(-zlib.MAX_WBITS)
+    while not inflate.eof:
+        chunk = inflate.unconsumed_tail or stream.next_chunk()
+        if not chunk:
+            raise EOFError('the stream ended early')
+        # at most a chunk of output at a time, whatever the compression ratio
+        yield inflate.decompress(chunk, 2 ** 20)
+    stream.unread(inflate.unused_data)
+
+
+def extract_zip_stream(stream, folder):
+    """Extracts a zip while it is read from stream"""
+    files = 0
+    for name, data in iter_zip(stream):
+        path = safe_path(folder, name)
+        if path is None:
+            logging.warning(f'Skipped archive member: {name}')
+        elif name.endswith('/'):
+            os.makedirs(path, exist_ok=True)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                for chunk in data:
+                    f.write(chunk)
+            files += 1
+    return files
+
+
+def make_processor(spec):
+    """Processor described in a config: "extract", the name of a hashlib algorithm,
+    or {"callback": "module:function", "name": ..., "pattern": ...}"""
+    if isinstance(spec, Processor):
+        return spec
+    if isinstance(spec, dict):
+        module, _, function = spec["callback"].partition(':')
+        function = getattr(importlib.import_module(module), function)
+        return CallbackProcessor(spec.get("name", function.__name__), function, spec.get("pattern", ''))
+    if spec == "extract":
+        return ExtractProcessor()
+    return HashProcessor(spec)
+
+
+class Job:
+    """The processing of one download, fed chunk by chunk by the thread that downloads it"""
+
+    def __init__(self, pipes):
+        self.pipes = pipes
+
+    def feed(self, chunk):
+        for pipe in self.pipes:
+            pipe.put(chunk)
+
+    def close(self, succeeded):
+        for pipe in self.pipes:
+            pipe.put(END if succeeded else ABORT)
+
+
+class PostProcessing:
+    """Runs the processors on the downloads while they are downloaded, on a pool of threads.
+
+    Every processor of a download gets a thread as soon as the download starts. The pool has a thread per processor
+    for each of the downloads that can run at once, plus workers threads for the processing that is still running
+    after its download finished, so it overlaps the next downloads. A download only waits for a thread when that
+    processing falls behind, rather than piling up chunks.
+    """
+
+    def __init__(self, processors, workers=2, downloads=1):
+        self.processors = [make_processor(spec) for spec in processors]
+        self.workers = downloads * len(self.processors) + max(workers, 0)
+        self.pool = ThreadPoolExecutor(self.workers, thread_name_prefix='post-process')
+        self.free = self.workers
+        self.condition = threading.Condition()
+        # jobs whose results were not handed to done yet
+        self.pending = 0
+
+    def open(self, path, done):
+        """Starts the processing of the file downloaded at path,
+        done is called with the results by processor name once every processor finished.
+        Returns the Job to feed with the file, None if no processor applies to it"""
+        processors = [processor for processor in self.processors if processor.matches(path)]
+        if not processors:
+            return None
+
+        with self.condition:
+            self.condition.wait_for(lambda: self.free >= len(processors))
+            self.free -= len(processors)
+            self.pending += 1
+
+        pipes = [Pipe() for _ in processors]
+        results, remaining = dict(), [len(processors)]
+
+        def finished(future):
+            with self.condition:
+                self.free += 1
+                self.condition.notify_all()
+                if (result := future.result()) is not None:
+                    results[result[0]] = result[1]
+                remaining[0] -= 1
+                if remaining[0]:
+                    return
+
+            try:
+                if results:
+                    done(results)
+            finally:
+                with self.condition:
+                    self.pending -= 1
+                    self.condition.notify_all()
+
+        for processor, pipe in zip(processors, pipes):
+            self.pool.submit(self.run, processor, pipe, path).add_done_callback(finished)
+        return Job(pipes)
+
+    @staticmethod
+    def run(processor, pipe, path):
+        try:
+            return processor.name, processor.process(pipe, path)
+        except Aborted:
+            return None
+        except Exception as e:
+            logging.error(f'Failed to post-process {path} ({processor.name}); with exception: {e}')
+            return None
+        finally:
+            if not pipe.ended:
+                pipe.drain()
+
+    def join(self):
+        """Waits until the downloads fed so far are processed and their results handed over"""
+        with self.condition:
+            self.condition.wait_for(lambda: self.pending == 0)
@@ -0,0 +1,118 @@
+import threading
+import time
+from datetime import timedelta
+
+
+class Transfer:
+    """A download in flight, its done counter is only written by the thread downloading it"""
+    __slots__ = ('name', 'size', 'done')
+
+    def __init__(self, name, size):
+        self.name = name
+        self.size = size
+        self.done = 0
+
+
+class Progress:
+    """Counts the files and bytes planned and downloaded during a crawl, and the transfers in flight.
+    The download path only adds to the counter of its transfer, the totals are computed by snapshot"""
+
+    def __init__(self, window=10):
+        self.lock = threading.Lock()
+        self.planned_files = 0
+        self.planned_bytes = 0
+        self.done_files = 0
+        self.failed_files = 0
+        # bytes of the finished transfers, and of all of them (failed included) for the speed
+        self.done_bytes = 0
+        self.moved_bytes = 0
+        self.transfers = set()
+
+        self.start_time = self.last_time = time.monotonic()
+        self.last_bytes = 0
+        self.average_speed = None
+        # weight of the newest sample in the moving average of the speed
+        self.smoothing = 2 / (window + 1)
+
+    def plan(self, size):
+        """A file of size bytes (negative if unknown) was queued for download"""
+        with self.lock:
+            self.planned_files += 1
+            self.planned_bytes += max(size, 0)
+
+    def start(self, name, size):
+        transfer = Transfer(name, size)
+        with self.lock:
+            self.transfers.add(transfer)
+        return transfer
+
+    def finish(self, transfer, succeeded):
+        with self.lock:
+            self.transfers.discard(transfer)
+            self.moved_bytes += transfer.done
+            if succeeded:
+                self.done_files += 1
+                self.done_bytes += transfer.done
+            else:
+                self.failed_files += 1
+
+    def snapshot(self):
+        """Totals, speeds and ETA at this moment, as a json serializable dict"""
+        with self.lock:
+            transfers = list(self.transfers)
+            in_flight_bytes = sum(transfer.done for transfer in transfers)
+            moved_bytes = self.moved_bytes + in_flight_bytes
+            done_bytes = self.done_bytes + in_flight_bytes
+
+            now = time.monotonic()
+            speed = (moved_bytes - self.last_bytes) / (now - self.last_time) if now > self.last_time else 0.0
+            self.last_time, self.last_bytes = now, moved_bytes
+            if self.average_speed is None:
+                self.average_speed = speed
+            else:
+                self.average_speed += self.smoothing * (speed - self.average_speed)
+
+            remaining = max(self.planned_bytes - done_bytes, 0)
+            return {
+                "planned_files": self.planned_files,
+                "done_files": self.done_files,
+                "failed_files": self.failed_files,
+                "planned_bytes": self.planned_bytes,
+                "done_bytes": done_bytes,
+                "speed": speed,
+                "average_speed": self.average_speed,
+                "eta": remaining / self.average_speed if self.average_speed else None,
+                "elapsed": now - self.start_time,
+                "in_flight": [{"name": transfer.name, "size": transfer.size, "done": transfer.done}
+                              for transfer in transfers]
+            }
+
+
+def format_progress(snapshot):
+    """One line summary of a Progress snapshot, for the terminal and the logs"""
+    eta = str(timedelta(seconds=round(snapshot["eta"]))) if snapshot["eta"] is not None else '-'
+    failed = f' ({snapshot["failed_files"]} failed)' if snapshot["failed_files"] else ''
+    return (f'files {snapshot["done_files"]}/{snapshot["planned_files"]}{failed}, '
+            f'{snapshot["done_bytes"] / 2 ** 20:.1f}/{snapshot["planned_bytes"] / 2 ** 20:.1f} MB, '
+            f'{snapshot["speed"] / 2 ** 20:.2f} MB/s (avg {snapshot["average_speed"] / 2 ** 20:.2f} MB/s), '
+            f'ETA {eta}, {len(snapshot["in_flight"])} in flight')
+
+
+class ProgressReporter(threading.Thread):
+    """Calls report with a snapshot of progress every interval seconds, until stopped"""
+
+    def __init__(self, progress, interval, report):
+        super().__init__(daemon=True)
+        self.progress = progress
+        self.interval = interval
+        self.report = report
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.report(self.progress.snapshot())
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        self.report(self.progress.snapshot())
@@ -0,0 +1,197 @@
+import json
+import logging
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse
+
+# headers of the listings kept in a recording, the body is stored decoded so content-encoding isn't one of them
+RECORDED_HEADERS = ('Content-Type', 'ETag', 'Last-Modified')
+# bytes written at a time when a replayed body is paced to its recorded duration
+REPLAY_CHUNK = 2 ** 16
+# keys of a crawler config holding lists of urls, and single urls, moved to the replay servers
+CONFIG_LISTS = ("urls", "accepted_domains")
+CONFIG_URLS = ("login_url", "download_url", "download_folder_url")
+
+
+class Recorder:
+    """Records the listings, and optionally the downloads, of a crawl in a sqlite database at path.
+
+    Every response is kept under the host, and the path and query, it was requested at, with its status, its time to
+    the headers and its total duration. The listings also keep their headers and their body, compressed;
+    the downloads only their size, except the folder archives, whose members are extracted, which keep their body.
+    """
+
+    def __init__(self, path, downloads=False):
+        self.path = path
+        self.downloads = downloads
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('CREATE TABLE IF NOT EXISTS responses (host TEXT, path TEXT, kind TEXT, status INTEGER, '
+                        'headers TEXT, ttfb REAL, duration REAL, size INTEGER, body BLOB, PRIMARY KEY (host, path))')
+        self.db.commit()
+
+    def write(self, kind, res, duration, size, body=None):
+        headers = {name: res.headers[name] for name in RECORDED_HEADERS if name in res.headers}
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO responses (host, path, kind, status, headers, ttfb, duration, size, body) '
+                            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                            (urlparse(res.request.url).netloc, res.request.path_url, kind, res.status_code, json.dumps(headers),
+                             res.elapsed.total_seconds(), duration, size,
+                             zlib.compress(body) if body is not None else None))
+
+    def listing(self, res, body, duration):
+        # a 304 only says the listing didn't change, the recorded one stays
+        if res.status_code != 304:
+            self.write('listing', res, duration, len(body), body)
+
+    def download(self, res, size, duration):
+        if self.downloads:
+            self.write('download', res, duration, size)
+
+    def archive(self, res, body, duration):
+        if self.downloads:
+            self.write('archive', res, duration, len(body), body)
+
+    def commit(self):
+        with self.lock:
+            self.db.commit()
+
+    def close(self):
+        with self.lock:
+            self.db.commit()
+            self.db.close()
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    """Answers the requests of the crawler with the responses of the recording, at their recorded pace"""
+
+    def log_message(self, format, *args):
+        logging.debug(f'Replay: {format % args}')
+
+    def do_POST(self):
+        # the login, any credentials are accepted
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.send_response(200)
+        self.send_header('Set-Cookie', 'replay=1; Path=/')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_GET(self):
+        row = self.server.find(self.path)
+        if row is None:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        kind, status, headers, ttfb, duration, size, body = row
+        headers = json.loads(headers)
+        time.sleep(ttfb * self.server.latency_scale)
+
+        if kind == 'listing' and headers.get('ETag') and self.headers.get('If-None-Match') == headers['ETag']:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        body = zlib.decompress(body) if body is not None else None
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(size))
+        self.end_headers()
+
+        # the body takes the rest of the recorded duration, a download is sent as zeros of its size
+        seconds = max(duration - ttfb, 0) * self.server.latency_scale
+        start, sent = time.monotonic(), 0
+        while sent < size:
+            chunk = body[sent:sent + REPLAY_CHUNK] if body is not None else bytes(min(REPLAY_CHUNK, size - sent))
+            self.wfile.write(chunk)
+            sent += len(chunk)
+            if (ahead := start + seconds * sent / size - time.monotonic()) > 0:
+                time.sleep(ahead)
+
+
+class ReplayServer(ThreadingHTTPServer):
+    """Local stand-in for the server host of a recording, the latencies are the recorded ones times latency_scale"""
+    daemon_threads = True
+
+    def __init__(self, path, host, latency_scale=1.0, port=0):
+        super().__init__(('127.0.0.1', port), ReplayHandler)
+        self.latency_scale = latency_scale
+        self.db = sqlite3.connect(f'file:{path}?mode=ro', uri=True, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.host = host
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_port}'
+
+    def find(self, path):
+        with self.lock:
+            return self.db.execute('SELECT kind, status, headers, ttfb, duration, size, body FROM responses '
+                                   'WHERE host = ? AND path = ?', (self.host, path)).fetchone()
+
+    def start(self):
+        """Serves in a background thread, returns the url of the server"""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self.url
+
+
+def recorded_hosts(path):
+    """The hosts of the responses of the recording at path"""
+    db = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        return [host for host, in db.execute('SELECT DISTINCT host FROM responses')]
+    finally:
+        db.close()
+
+
+def redirect(url, bases):
+    """The url on the replay server of its host in bases, same path and query"""
+    uri = urlparse(url)
+    return bases[uri.netloc] + url[len(f'{uri.scheme}://{uri.netloc}'):]
+
+
+def redirect_config(config, bases):
+    """The config of a crawler with its urls moved to the replay servers at bases, by original host"""
+    config = dict(config)
+    for key in CONFIG_LISTS:
+        if config.get(key):
+            config[key] = [redirect(url, bases) for url in config[key]]
+    for key in CONFIG_URLS:
+        if config.get(key):
+            config[key] = redirect(config[key], bases)
+    # a replayed crawl doesn't announce its downloads
+    config.pop("webhook-url", None)
+    return config
+
+
+def start_replay(path, config, latency_scale=1.0):
+    """Serves the recording at path for the crawler of config, with a server for each of the hosts of the recording
+    and of the config, so the responses of different hosts under the same path don't replace each other.
+    Returns the servers by original host and the config redirected to them"""
+    hosts = set(recorded_hosts(path))
+    for key in CONFIG_LISTS:
+        hosts.update(urlparse(url).netloc for url in config.get(key) or ())
+    for key in CONFIG_URLS:
+        if config.get(key):
+            hosts.add(urlparse(config[key]).netloc)
+
+    servers = {host: ReplayServer(path, host, latency_scale) for host in sorted(hosts)}
+    bases = {host: server.start() for host, server in servers.items()}
+    return servers, redirect_config(config, bases)
+
+
+if __name__ == '__main__':
+    # python replay.py recording.db [latency scale] [port], the hosts are served on consecutive ports
+    logging.basicConfig(format='%(asctime)s %(levelname)s:%(message)s', level=logging.INFO)
+    scale = float(sys.argv[2]) if len(sys.argv) > 2 else 1.0
+    port = int(sys.argv[3]) if len(sys.argv) > 3 else 8000
+    for i, host in enumerate(recorded_hosts(sys.argv[1])):
+        server = ReplayServer(sys.argv[1], host, scale, port + i)
+        logging.info(f'Replaying {host} at {server.start()}')
+    threading.Event().wait()